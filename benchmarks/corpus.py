@@ -0,0 +1,219 @@
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Generate a synthetic tutorial for benchmarking the scripts.
+
+The generated tutorial looks like this one: README.md has a list of
+contents with a section for each subdirectory, and the chapters have
+titles, links to titles of other chapters, images and code examples.
+
+    python3 benchmarks/corpus.py /tmp/big-tutorial --chapters 1000
+"""
+
+import argparse
+import os
+import random
+import struct
+import zlib
+
+
+WORDS = ('python function list loop string variable dictionary module '
+         'class exception file tuple print return import value').split()
+
+README_START = """\
+# Synthetic tutorial
+
+This tutorial was generated by benchmarks/corpus.py.
+
+## List of contents
+
+"""
+
+# update-ends.py adds links to these
+README_END = """\
+## Frequently asked questions
+
+### How can I thank you for writing and sharing this tutorial?
+
+By [benchmarking](#list-of-contents) the scripts.
+"""
+OTHER_FILES = {
+    'contact-me.md': '# Contact me\n\nThis is generated.\n',
+    'getting-help.md': '# Getting help\n\nThis is generated too.\n',
+}
+
+
+def make_png(width, height, seed):
+    """Return the bytes of a PNG image filled with random pixels."""
+    rng = random.Random(seed)
+    rows = b''.join(
+        b'\0' + bytes(rng.randrange(256) for i in range(width * 3))
+        for row in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data)))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize() + '.'
+
+
+def code_block(rng):
+    if rng.random() < 0.5:
+        # a >>> session like in basics/
+        lines = ['```python']
+        for i in range(rng.randint(1, 4)):
+            word = rng.choice(WORDS)
+            lines.append(">>> %s = '%s'" % (word, word * 2))
+            lines.append(">>> %s.upper()" % word)
+            lines.append("'%s'" % (word * 2).upper())
+        lines.append('>>>')
+    else:
+        lines = ['```python', 'def %s(x):' % rng.choice(WORDS)]
+        for i in range(rng.randint(1, 6)):
+            lines.append('    # %s' % sentence(rng, 5))
+            lines.append('    x = x + %d' % i)
+        lines.append('    return x')
+    lines.append('```')
+    return '\n'.join(lines)
+
+
+def generate_chapter(rng, title, headers, code_blocks, links, images,
+                     all_chapters, image_names):
+    """Return the content of a chapter markdown file as a string.
+
+    headers is a list of ## titles. all_chapters is a list of (path
+    relative to this chapter, header titles) pairs for making links to
+    other chapters.
+    """
+    parts = ['# ' + title]
+    paragraphs = max(len(headers), code_blocks, links, images, 1)
+    for index in range(paragraphs):
+        if index < len(headers):
+            parts.append('## ' + headers[index])
+        text = sentence(rng)
+        if index < links:
+            path, titles = rng.choice(all_chapters)
+            if titles:
+                path += '#' + rng.choice(titles).lower().replace(' ', '-')
+            text += ' See [%s](%s).' % (rng.choice(WORDS), path)
+        parts.append(text)
+        if index < images and image_names:
+            parts.append('![%s](../images/%s)'
+                         % (rng.choice(WORDS), rng.choice(image_names)))
+        if index < code_blocks:
+            parts.append(code_block(rng))
+    return '\n\n'.join(parts) + '\n'
+
+
+def generate(directory, chapters=50, sections=2, headers=8, code_blocks=6,
+             links=10, images=2, image_files=10, seed=0):
+    """Write a synthetic tutorial to a directory.
+
+    chapters is the total number of chapters, and they are split evenly
+    between the sections. headers, code_blocks, links and images are
+    counts for each chapter, and image_files is the number of different
+    PNG files in the images directory.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+    image_names = []
+    for number in range(image_files):
+        name = 'image%d.png' % number
+        with open(os.path.join(directory, 'images', name), 'wb') as f:
+            f.write(make_png(64, 48, seed + number))
+        image_names.append(name)
+
+    for filename in ['LICENSE', 'html-style.css']:
+        with open(os.path.join(directory, filename), 'w') as f:
+            f.write('/* generated by benchmarks/corpus.py */\n')
+    for filename, content in OTHER_FILES.items():
+        with open(os.path.join(directory, filename), 'w') as f:
+            f.write(content)
+
+    # [(section, filename, title, header titles), ...]
+    chapter_list = []
+    for number in range(chapters):
+        section = 'section%d' % (number % sections)
+        titles = ['%s %d' % (rng.choice(WORDS).capitalize(), index)
+                  for index in range(headers)]
+        chapter_list.append((section, 'chapter%d.md' % number,
+                             'Chapter %d' % number, titles))
+
+    readme = [README_START]
+    for section in sorted({chapter[0] for chapter in chapter_list}):
+        readme.append('### %s\n\n' % section.capitalize())
+        numbers = (n for n in range(1, chapters + 1))
+        for chapter_section, filename, title, titles in chapter_list:
+            if chapter_section == section:
+                readme.append('%d. [%s](%s/%s)\n'
+                              % (next(numbers), title, section, filename))
+        readme.append('\n')
+    readme.append(README_END)
+    with open(os.path.join(directory, 'README.md'), 'w') as f:
+        f.write(''.join(readme))
+
+    for section, filename, title, titles in chapter_list:
+        os.makedirs(os.path.join(directory, section), exist_ok=True)
+        others = [('../%s/%s' % (other[0], other[1]), other[3])
+                  for other in chapter_list]
+        content = generate_chapter(rng, title, titles, code_blocks, links,
+                                   images, others, image_names)
+        with open(os.path.join(directory, section, filename), 'w') as f:
+            f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic tutorial for benchmarking.")
+    parser.add_argument('directory', help="create the tutorial here")
+    parser.add_argument('--chapters', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=2)
+    parser.add_argument('--headers', type=int, default=8,
+                        help="number of ## titles in each chapter")
+    parser.add_argument('--code-blocks', type=int, default=6,
+                        help="number of code examples in each chapter")
+    parser.add_argument('--links', type=int, default=10,
+                        help="number of links in each chapter")
+    parser.add_argument('--images', type=int, default=2,
+                        help="number of images shown in each chapter")
+    parser.add_argument('--image-files', type=int, default=10,
+                        help="number of files in the images directory")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.directory, args.chapters, args.sections, args.headers,
+             args.code_blocks, args.links, args.images, args.image_files,
+             args.seed)
+
+
+if __name__ == '__main__':
+    main()
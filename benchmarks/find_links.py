@@ -0,0 +1,116 @@
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Compare common.find_links() to the old line pair scanner.
+
+Run this from anywhere like this:
+
+    python3 benchmarks/find_links.py
+"""
+
+import argparse
+import itertools
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import common     # noqa
+
+
+def old_find_links(file):
+    """This is how common.find_links() used to work."""
+    seen = set()
+    firsts, seconds = itertools.tee(file)
+    next(seconds)
+    for lineno, linepair in enumerate(zip(firsts, seconds), start=2):
+        lines = linepair[0] + linepair[1]
+        for match in re.finditer(r'!?\[(.*?)\]\((.*?)\)', lines,
+                                 flags=re.DOTALL):
+            if match.group(0) not in seen:
+                seen.add(match.group(0))
+                yield match, lineno
+
+
+# (markdown, [(text, target), ...]) pairs that both scanners must agree on
+CASES = [
+    ('[a](b.md) and ![c](d.png)', [('a', 'b.md'), ('c', 'd.png')]),
+    ('a [link\nthat wraps](b.md)', [('link\nthat wraps', 'b.md')]),
+    ('[`a[0]`](lists.md)', [('`a[0]`', 'lists.md')]),
+]
+
+
+def check_cases():
+    """Make sure that the new scanner finds the same links as the old one."""
+    for markdown, expected in CASES:
+        # the old scanner looks at pairs of lines, so it needs two lines
+        lines = (markdown + '\n\n').splitlines(keepends=True)
+        old = [match.group(1, 2) for match, lineno in old_find_links(lines)]
+        new = [match.group(1, 2) for match, lineno, column
+               in common.find_links(markdown)]
+        assert old == new == expected, (markdown, old, new)
+
+
+def generate_markdown(lines, links_per_line):
+    """Return a markdown string with lots of links in it."""
+    random.seed(lines)
+    words = ['python', 'tutorial', 'loop', 'function', 'list', 'string']
+    result = []
+    for lineno in range(lines):
+        line = ' '.join(random.choice(words) for i in range(10))
+        for i in range(links_per_line):
+            line += ' [%s](%s.md#title-%d)' % (
+                random.choice(words), random.choice(words), lineno)
+        result.append(line + '\n')
+    return ''.join(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help="time each case this many times, defaults to %(default)s")
+    args = parser.parse_args()
+
+    check_cases()
+    print('%10s  %10s  %10s  %10s' % ('lines', 'old', 'new', 'speedup'))
+    for lines in [1000, 10000, 100000]:
+        text = generate_markdown(lines, links_per_line=2)
+        old = min(timeit.repeat(
+            lambda: list(old_find_links(text.splitlines(keepends=True))),
+            number=1, repeat=args.repeat))
+        new = min(timeit.repeat(
+            lambda: list(common.find_links(text)),
+            number=1, repeat=args.repeat))
+        print('%10d  %9.1fms  %9.1fms  %9.1fx'
+              % (lines, old*1000, new*1000, old/new))
+
+
+if __name__ == '__main__':
+    main()
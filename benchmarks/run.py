@@ -0,0 +1,248 @@
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Time the phases of each script on a synthetic tutorial.
+
+This generates a tutorial with corpus.py, runs the phases of
+update-readmes.py, update-ends.py, linkcheck.py and make-html.py in it
+in that order, and prints how long each phase took, how many markdown
+files it handled per second and how much memory it needed at most. The
+scripts don't share cached files between each other, just like when
+they run in separate processes.
+
+    python3 benchmarks/run.py --chapters 500 --json results.json
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import common     # noqa
+import corpus     # noqa
+
+
+def get_phases(outdir):
+    """Return a list of (script, phase, function) tuples."""
+    update_readmes = importlib.import_module('update-readmes')
+    update_ends = importlib.import_module('update-ends')
+    linkcheck = importlib.import_module('linkcheck')
+    make_html = importlib.import_module('make-html')
+    if make_html.has_pygments():
+        style = make_html.get_tutorial_style()
+    else:
+        style = None
+    rendered = {}
+
+    def render():
+        rendered.clear()
+        rendered.update(make_html.render_pages(
+            sorted(common.get_markdown_files()), style))
+
+    def write():
+        for markdownfile, html in rendered.items():
+            htmlfile = os.path.join(
+                outdir, make_html.fix_filename(markdownfile))
+            with make_html.mkdir_and_open(htmlfile, 'w') as f:
+                f.write(html)
+
+    def copy():
+        shutil.copytree('images', os.path.join(outdir, 'images'),
+                        dirs_exist_ok=True)
+
+    def scan():
+        for path in common.get_markdown_files():
+            linkcheck.find_titles(path)
+            linkcheck.find_links(path)
+
+    return [
+        ('update-readmes', 'get_contents', update_readmes.get_contents),
+        ('update-readmes', 'main', update_readmes.main),
+        ('update-ends', 'get_filenames', update_ends.get_filenames),
+        ('update-ends', 'update_ends',
+         lambda: update_ends.update_ends(update_ends.get_ends())),
+        ('linkcheck', 'scan', scan),
+        ('linkcheck', 'check', linkcheck.check_all),
+        ('make-html', 'render', render),
+        ('make-html', 'write', write),
+        ('make-html', 'copy', copy),
+    ]
+
+
+def run_phase(function, memory):
+    """Call a function and return (seconds, peak bytes or None)."""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    seconds = time.perf_counter() - start
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peak = None
+    return (seconds, peak)
+
+
+def read_markdown_files():
+    """Return a {path: content} dictionary of the markdown files."""
+    result = {}
+    for path in common.get_markdown_files():
+        with open(path, 'rb') as f:
+            result[path] = f.read()
+    return result
+
+
+def restore_markdown_files(contents):
+    """Undo changes to the markdown files since read_markdown_files()."""
+    for path in set(common.get_markdown_files()) - contents.keys():
+        os.remove(path)
+    for path, content in contents.items():
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == content:
+                    continue
+        except FileNotFoundError:
+            pass
+        with open(path, 'wb') as f:
+            f.write(content)
+
+
+def run_benchmarks(memory=True):
+    """Run all phases in the current directory and return the results.
+
+    Memory is measured with tracemalloc, which makes everything slower,
+    so each phase runs twice when memory is True: once for the time and
+    once for the memory. The markdown files are restored between the
+    runs, so phases that change them do the same work both times.
+    """
+    files = len(list(common.get_markdown_files()))
+    outdir = tempfile.mkdtemp()
+    results = []
+    try:
+        previous_script = None
+        for script, phase, function in get_phases(outdir):
+            if script != previous_script:
+                # like a new process
+                common.forget_document()
+                previous_script = script
+            if memory:
+                contents = read_markdown_files()
+            seconds, peak = run_phase(function, memory=False)
+            if memory:
+                restore_markdown_files(contents)
+                common.forget_document()
+                ignored, peak = run_phase(function, memory=True)
+            results.append({
+                'script': script,
+                'phase': phase,
+                'seconds': seconds,
+                'files_per_second': files / seconds if seconds else None,
+                'peak_memory': peak,
+            })
+    finally:
+        shutil.rmtree(outdir)
+    return results
+
+
+def print_results(results):
+    print('%-15s %-14s %10s %12s %10s'
+          % ('script', 'phase', 'time', 'files/s', 'memory'))
+    for result in results:
+        if result['files_per_second'] is None:
+            rate = '-'
+        else:
+            rate = '%.0f' % result['files_per_second']
+        if result['peak_memory'] is None:
+            memory = '-'
+        else:
+            memory = '%.1fMB' % (result['peak_memory'] / 1024 / 1024)
+        print('%-15s %-14s %8.1fms %12s %10s'
+              % (result['script'], result['phase'],
+                 result['seconds'] * 1000, rate, memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the scripts on a synthetic tutorial.")
+    parser.add_argument(
+        '--directory', metavar='DIR',
+        help=("use an existing tutorial here instead of generating a "
+              "temporary one, note that the scripts will modify it"))
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help="also write the results and the settings to a JSON file")
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help="don't measure memory, this makes the benchmark faster")
+    parser.add_argument('--chapters', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=2)
+    parser.add_argument('--headers', type=int, default=8)
+    parser.add_argument('--code-blocks', type=int, default=6)
+    parser.add_argument('--links', type=int, default=10)
+    parser.add_argument('--images', type=int, default=2)
+    parser.add_argument('--image-files', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.directory is None:
+        directory = tempfile.mkdtemp()
+        corpus.generate(directory, args.chapters, args.sections,
+                        args.headers, args.code_blocks, args.links,
+                        args.images, args.image_files, args.seed)
+    else:
+        directory = args.directory
+
+    old_cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        results = run_benchmarks(memory=not args.no_memory)
+    finally:
+        os.chdir(old_cwd)
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
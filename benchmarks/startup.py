@@ -0,0 +1,128 @@
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""Measure how long it takes for make-html.py to start.
+
+This runs 'make-html.py --help' and a build with --incremental that has
+nothing to do many times and prints the median times. It also prints
+the modules that take the longest to import according to
+'python -X importtime', like this:
+
+    python3 benchmarks/startup.py --runs 20 --top 15
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOPLEVEL = os.path.dirname(HERE)
+
+
+def time_command(args, runs, stdin=None):
+    """Run a Python script many times and return the median seconds."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=TOPLEVEL, input=stdin,
+                       stdout=subprocess.DEVNULL, check=True,
+                       universal_newlines=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def get_top_imports(args):
+    """Run Python with -X importtime and return {module: microseconds}.
+
+    Only the modules imported by the script itself are included, and
+    the time includes everything that they import.
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args, cwd=TOPLEVEL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True).stderr
+
+    result = {}
+    for line in stderr.splitlines()[1:]:
+        # import time: self [us] | cumulative | imported package
+        self_time, cumulative, name = line.split('|')
+        if not name.startswith('  '):
+            # not imported by a module that was imported by the script
+            result[name.strip()] = int(cumulative)
+    return result
+
+
+def get_import_times():
+    """Return (module, microseconds) pairs of make-html.py --help.
+
+    The slowest imports come first.
+    """
+    # python imports these before running anything
+    startup = get_top_imports(['-c', 'pass'])
+    imports = get_top_imports(['make-html.py', '--help'])
+    return sorted(((name, time) for name, time in imports.items()
+                   if name not in startup),
+                  key=lambda pair: pair[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of make-html.py.")
+    parser.add_argument(
+        '--runs', metavar='N', type=int, default=10,
+        help="run each command N times, defaults to %(default)s")
+    parser.add_argument(
+        '--top', metavar='N', type=int, default=10,
+        help="show N slowest imports, defaults to %(default)s")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outdir:
+        build = ['make-html.py', '--incremental', '--outdir', outdir]
+        # the first build renders everything
+        time_command(build, 1, stdin='n\n')
+        results = [
+            ('python -c pass', time_command(['-c', 'pass'], args.runs)),
+            ('make-html.py --help',
+             time_command(['make-html.py', '--help'], args.runs)),
+            ('make-html.py --incremental, nothing to do',
+             time_command(build, args.runs, stdin='n\n')),
+        ]
+
+    for command, seconds in results:
+        print('%-45s %8.1fms' % (command, seconds * 1000))
+    print()
+    imports = get_import_times()
+    print("make-html.py --help imports modules for %.1fms, the slowest are:"
+          % (sum(time for name, time in imports) / 1000))
+    for name, microseconds in imports[:args.top]:
+        print('  %-43s %8.1fms' % (name, microseconds / 1000))
+
+
+if __name__ == '__main__':
+    main()
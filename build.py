@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Run all the scripts of this tutorial in one process.
+
+This does what running update-readmes.py, update-ends.py, linkcheck.py
+and make-html.py one after another would do, but README.md and the
+markdown files are read only once. Nothing is asked from the user, so
+this can be used in CI:
+
+    python3 build.py
+
+The exit status is 1 if there are broken links. The link check and the
+HTML files are skipped if nothing has changed since the previous run.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+import common
+
+update_readmes = importlib.import_module('update-readmes')
+update_ends = importlib.import_module('update-ends')
+linkcheck = importlib.import_module('linkcheck')
+make_html = importlib.import_module('make-html')
+
+
+BUILD_STATE = os.path.join(common.CACHE_DIR, 'build.json')
+
+
+def get_state(outdir, graph):
+    """Return a dictionary that changes when the output would change.
+
+    Markdown files are compared by their content, and other files by
+    their size and modification time because they may be big.
+    """
+    scripts = [common, update_readmes, update_ends, linkcheck, make_html]
+    others = [source for source, destination in make_html.OTHER_FILES]
+    others.extend(make_html.get_referenced_assets(graph))
+
+    state = {
+        'outdir': outdir,
+        'scripts': {module.__name__: common.get_file_hash(module.__file__)
+                    for module in scripts},
+        'markdown': {path: common.get_document(path).hash
+                     for path in sorted(common.get_markdown_files())},
+        'other': {},
+    }
+    for path in sorted(others):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            state['other'][path] = None
+        else:
+            state['other'][path] = [stat.st_size, stat.st_mtime_ns]
+    return state
+
+
+def load_state():
+    try:
+        with open(BUILD_STATE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(BUILD_STATE), exist_ok=True)
+    with open(BUILD_STATE, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def build(outdir, jobs=1, force=False):
+    """Run everything and return the number of broken links."""
+    print("Updating README files...")
+    contents = update_readmes.get_contents()
+    update_readmes.update_readmes(contents)
+    print()
+
+    # update_readmes() may have created new markdown files, but nothing
+    # after this does that
+    with common.remember_markdown_files():
+        print("Updating ends of files...")
+        ends = update_ends.get_ends(contents)
+        changed = update_ends.update_ends(ends)
+        for filename in changed:
+            print("  Updated end:", filename)
+        print("  %d/%d files had to be updated" % (len(changed), len(ends)))
+        print()
+
+        graph = common.update_dependency_graph()
+        state = get_state(outdir, graph)
+        old_state = load_state()
+        if (not force and os.path.isdir(outdir) and
+                old_state is not None and
+                state == old_state['inputs']):
+            print("Nothing has changed since the previous build, the links "
+                  "and %s are up to date." % outdir)
+            if old_state['broken']:
+                print("There were %d broken links, run linkcheck.py to "
+                      "see them." % old_state['broken'])
+            return old_state['broken']
+
+        print("Checking the links...")
+        result, rechecked = linkcheck.check_incremental()
+        broken, total = linkcheck.print_broken_links(sorted(result.items()))
+        print("  %d/%d links seem to be broken" % (broken, total))
+        print()
+
+        print("Generating HTML files...")
+        if not make_html.has_pygments():
+            print("  Pygments isn't installed, so the code examples will "
+                  "not be colored.")
+            style = None
+            highlight_cache = None
+        else:
+            style = make_html.get_tutorial_style()
+            highlight_cache = make_html.HighlightCache(
+                os.path.join(common.CACHE_DIR, 'highlight'),
+                10 * 1024 * 1024)
+        make_html.build_incremental(outdir, style, jobs, highlight_cache)
+        if highlight_cache is not None:
+            highlight_cache.cleanup()
+        print()
+
+        print("Copying other files...")
+        make_html.copy_other_files(outdir)
+
+    save_state({'inputs': state, 'broken': broken})
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=("Update the README files and ends of the markdown "
+                     "files, check the links and generate HTML."))
+    parser.add_argument(
+        '-o', '--outdir', default='html',
+        help="write the HTML files here, defaults to %(default)r")
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=1,
+        help=("render N pages at a time in separate processes, 0 means "
+              "one process for each CPU core, defaults to %(default)s"))
+    parser.add_argument(
+        '--force', action='store_true',
+        help="check the links and update the HTML even if nothing changed")
+    args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+
+    broken = build(args.outdir, args.jobs, args.force)
+    print()
+    if broken:
+        print("Done, but %d links seem to be broken." % broken)
+        sys.exit(1)
+    print("Done.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Check that the Python examples in the tutorial still work.
+
+Code blocks that start with >>> are run like doctests, so the output
+must be what the tutorial shows. Other ```python blocks are only
+compiled because they may ask for input or run forever. The >>>
+examples of a page continue the same interactive session, so they run
+in order in one process, in a temporary directory. The results of each
+page are cached, so only pages with new or edited examples run next
+time.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import common
+
+
+EXAMPLE_CACHE = os.path.join(common.CACHE_DIR, 'examples.json')
+
+# examples that are known to fail, {filename: [hash of code, ...]}, see
+# --update-known
+KNOWN_BROKEN = 'known-broken-examples.json'
+
+# this runs in the subprocess, it gets a JSON list of [mode, code] lists
+# from stdin and prints a RESULT line for each example
+RUNNER = """\
+import doctest, json, sys
+examples = json.load(sys.stdin)
+sys.stdin.close()
+stdout = sys.stdout
+globs = {'__name__': '__main__'}
+for mode, code in examples:
+    output = []
+    if mode == 'compile':
+        try:
+            compile(code, 'example', 'exec')
+        except SyntaxError as e:
+            output.append('Line %s: %s: %s\\n'
+                          % (e.lineno, type(e).__name__, e.msg))
+        ok = not output
+    else:
+        test = doctest.DocTestParser().get_doctest(
+            code, globs, 'example', None, None)
+        runner = doctest.DocTestRunner(optionflags=doctest.ELLIPSIS)
+        runner.run(test, out=output.append, clear_globs=False)
+        ok = not runner.failures
+        # the next >>> example continues from here
+        globs = test.globs
+    print('RESULT ' + json.dumps([ok, ''.join(output)]), file=stdout,
+          flush=True)
+"""
+
+Example = collections.namedtuple('Example', 'filename lineno mode code')
+
+
+def get_examples(filenames):
+    """Return a list of Example namedtuples of ```python blocks.
+
+    mode is 'doctest' for >>> examples and 'compile' for the others,
+    and lineno is the line of the first ```.
+    """
+    result = []
+    for filename in filenames:
+        for block in common.get_document(filename).code_blocks:
+            if block.lang != 'python':
+                continue
+            # make-html.py uses the same check for highlighting
+            if block.code.startswith('>>> '):
+                mode = 'doctest'
+            else:
+                mode = 'compile'
+            result.append(Example(filename, block.start, mode, block.code))
+    return result
+
+
+def get_python_version(python):
+    """Return the full version string of a Python interpreter."""
+    return subprocess.run(
+        [python, '-c', 'import sys; print(sys.version)'],
+        stdout=subprocess.PIPE, check=True,
+        universal_newlines=True).stdout.strip()
+
+
+def get_key(examples, python_version):
+    """Return a cache key for the examples of a page.
+
+    The key changes when the result might change, e.g. when any example
+    on the page changes, because the later examples may depend on it.
+    """
+    parts = [RUNNER, python_version]
+    for example in examples:
+        parts.extend([example.mode, example.code])
+    return common.get_hash('\0'.join(parts))
+
+
+def run_examples(examples, python, timeout):
+    """Run the examples of a page in order in a new process.
+
+    Return (results, timed_out) where results is a list of (ok, output)
+    tuples, one for each example, and output explains what went wrong.
+    """
+    # set and dict orders must be the same every time because the
+    # results are cached
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    stdin = json.dumps([[example.mode, example.code]
+                        for example in examples])
+
+    # examples may create files, so they run in an empty directory
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            stdout = subprocess.run(
+                [python, '-c', RUNNER], cwd=directory, env=env,
+                input=stdin.encode('utf-8'), stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, timeout=timeout).stdout
+            timed_out = False
+        except subprocess.TimeoutExpired as e:
+            # the examples that finished printed their results
+            stdout = e.stdout or b''
+            timed_out = True
+
+    results = []
+    other_output = []
+    for line in stdout.decode('utf-8', errors='replace').splitlines():
+        if line.startswith('RESULT '):
+            results.append(tuple(json.loads(line[len('RESULT '):])))
+        else:
+            other_output.append(line + '\n')
+
+    if len(results) < len(examples):
+        if timed_out:
+            message = "Didn't finish in %s seconds." % timeout
+        else:
+            # the process crashed or an example exited it
+            message = ''.join(other_output) or "The examples stopped here."
+        results.append((False, message))
+        results.extend([(False, "Didn't run because of line %d."
+                         % examples[len(results) - 1].lineno)]
+                       * (len(examples) - len(results)))
+    return (results, timed_out)
+
+
+def load_cache():
+    try:
+        with open(EXAMPLE_CACHE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(EXAMPLE_CACHE), exist_ok=True)
+    with open(EXAMPLE_CACHE, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def check_examples(examples, python=sys.executable, jobs=None, timeout=10,
+                   use_cache=True, prune_cache=True):
+    """Run examples that aren't in the cache, and return the results.
+
+    The result is a list of (example, ok, output) tuples in the same
+    order as the examples. jobs is the number of pages running at the
+    same time, and None means one for each CPU core. timeout is for all
+    examples of a page together. Pages that time out are not cached,
+    because they might finish next time.
+
+    If prune_cache is True, results of pages that aren't in the
+    examples are removed from the cache, so it should be False when
+    only some files are checked.
+    """
+    python_version = get_python_version(python)
+    cache = load_cache() if use_cache else {}
+    pages = collections.OrderedDict()
+    for example in examples:
+        pages.setdefault(example.filename, []).append(example)
+    keys = {filename: get_key(page_examples, python_version)
+            for filename, page_examples in pages.items()}
+    todo = [filename for filename in pages if keys[filename] not in cache]
+
+    print("Running the examples of %d/%d files, the rest came from the "
+          "cache" % (len(todo), len(pages)))
+    results = {key: cache[key] for key in keys.values() if key in cache}
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    # the examples run in subprocesses, so threads are enough here
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = {filename: executor.submit(
+                       run_examples, pages[filename], python, timeout)
+                   for filename in todo}
+        for filename, future in futures.items():
+            page_results, timed_out = future.result()
+            results[keys[filename]] = page_results
+            if not timed_out:
+                cache[keys[filename]] = page_results
+
+    if use_cache:
+        if prune_cache:
+            # forget the pages whose examples changed or are gone
+            cache = {key: cache[key] for key in keys.values()
+                     if key in cache}
+        save_cache(cache)
+
+    result = []
+    for filename, page_examples in pages.items():
+        for example, (ok, output) in zip(page_examples,
+                                         results[keys[filename]]):
+            result.append((example, ok, output))
+    return result
+
+
+def load_known_broken():
+    try:
+        with open(KNOWN_BROKEN, 'r') as f:
+            return {filename: set(hashes)
+                    for filename, hashes in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_known_broken(known):
+    with open(KNOWN_BROKEN, 'w') as f:
+        json.dump({filename: sorted(hashes)
+                   for filename, hashes in sorted(known.items())
+                   if hashes}, f, indent=2)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the Python examples of the tutorial.")
+    parser.add_argument(
+        'files', metavar='FILE', nargs='*',
+        help="markdown files to check, defaults to all of them")
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=None,
+        help=("run the examples of N files at a time, defaults to the "
+              "number of CPUs"))
+    parser.add_argument(
+        '--timeout', metavar='SECONDS', type=float, default=10,
+        help=("give up on the examples of a file after this, defaults "
+              "to %(default)s"))
+    parser.add_argument(
+        '--python', metavar='PROGRAM', default=sys.executable,
+        help="the Python interpreter to use, defaults to %(default)r")
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help=("run everything and don't use or update %s"
+              % EXAMPLE_CACHE))
+    parser.add_argument(
+        '--update-known', action='store_true',
+        help=("save the broken examples of the checked files to %s, so "
+              "that they don't make this fail next time" % KNOWN_BROKEN))
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be 1 or more")
+
+    filenames = args.files or sorted(common.get_markdown_files())
+    examples = get_examples(filenames)
+    results = check_examples(examples, args.python, args.jobs,
+                             args.timeout, not args.no_cache,
+                             prune_cache=not args.files)
+
+    known = load_known_broken()
+    if args.update_known:
+        for filename in filenames:
+            known[filename] = set()
+        for example, ok, output in results:
+            if not ok:
+                known[example.filename].add(common.get_hash(example.code))
+        save_known_broken(known)
+
+    failed = 0
+    known_failed = 0
+    fixed = 0
+    for example, ok, output in results:
+        is_known = (common.get_hash(example.code) in
+                    known.get(example.filename, ()))
+        if ok:
+            fixed += is_known
+        elif is_known:
+            known_failed += 1
+        else:
+            print("  file %s, line %d:" % (example.filename, example.lineno))
+            for line in output.rstrip().splitlines():
+                print("    " + line)
+            failed += 1
+
+    if known_failed:
+        print("%d broken examples are listed in %s, so they were ignored."
+              % (known_failed, KNOWN_BROKEN))
+    if fixed:
+        print("%d examples in %s work now, run with --update-known to "
+              "remove them." % (fixed, KNOWN_BROKEN))
+    print("%d/%d examples seem to be broken." % (failed, len(results)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
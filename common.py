@@ -31,39 +31,58 @@ posixpath module for processing paths, but they use functions in this
 file when actually opening files.
 """
 
+import bisect
+import collections
 import contextlib
-import itertools
+import functools
+import hashlib
+import json
 import os
 import posixpath
 import re
 import shutil
-import string
+import unicodedata
 
 
-_LINK_REGEX = r'!?\[(.*?)\]\((.*?)\)'
+# The text of a link can contain one level of [brackets], like in
+# [`a[0]`](lists.md) or [![image](x.png)](y.md), and the target can't
+# contain ), so the regex never needs to look far for the end of a
+# link. That's why it can be used on a whole file at once.
+_LINK_REGEX = re.compile(r'!?\[((?:[^\[\]]|\[[^\[\]]*\])*)\]\(([^)]*)\)')
 
+# scripts save things here to make the next run faster
+CACHE_DIR = '.cache'
+DEPENDENCY_GRAPH = os.path.join(CACHE_DIR, 'dependencies.json')
 
-def find_links(file):
-    """Find all markdown links in a file object.
 
-    Yield (lineno, regexmatch) tuples.
+def find_links(text):
+    """Find all markdown links in a string.
+
+    Yield (regexmatch, lineno, column) tuples. The links may span any
+    number of lines, and lineno and column tell where the link starts.
+    Both start at 1.
     """
-    # don't yield same link twice
-    seen = set()
+    # the regex runs on the whole text, so we need to convert offsets
+    # of the matches to line numbers
+    newlines = [match.start() for match in re.finditer('\n', text)]
+    for match in _find_link_matches(text, 0, len(text)):
+        # the number of newlines before the link tells the line number
+        index = bisect.bisect_left(newlines, match.start())
+        line_start = newlines[index-1] + 1 if index > 0 else 0
+        yield match, index + 1, match.start() - line_start + 1
+
+
+def _find_link_matches(text, start, end):
+    for match in _LINK_REGEX.finditer(text, start, end):
+        yield match
+        if '[' in match.group(1):
+            # an image or another link inside the text of this link
+            yield from _find_link_matches(text, match.start(1),
+                                          match.end(1))
 
-    # we need to loop over the file two lines at a time to support
-    # multi-line (actually two-line) links, so this is kind of a mess
-    firsts, seconds = itertools.tee(file)
-    next(seconds)  # first line is never second line
 
-    # we want 1-based indexing instead of 0-based and one-line links get
-    # caught from linepair[1], so we need to start at two
-    for lineno, linepair in enumerate(zip(firsts, seconds), start=2):
-        lines = linepair[0] + linepair[1]
-        for match in re.finditer(_LINK_REGEX, lines, flags=re.DOTALL):
-            if match.group(0) not in seen:
-                seen.add(match.group(0))
-                yield match, lineno
+# a list of markdown files when inside remember_markdown_files()
+_markdown_files = None
 
 
 def get_markdown_files():
@@ -71,7 +90,12 @@ def get_markdown_files():
 
     The yielded paths use / as the path separator.
     """
+    if _markdown_files is not None:
+        yield from _markdown_files
+        return
     for root, dirs, files in os.walk('.'):
+        # things like .git and .pytest_cache aren't a part of the tutorial
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
         for file in files:
             if not file.endswith('.md'):
                 continue
@@ -79,23 +103,326 @@ def get_markdown_files():
             yield path.replace(os.sep, '/')
 
 
+@contextlib.contextmanager
+def remember_markdown_files():
+    """Make get_markdown_files() look for the files only once.
+
+    This is useful when many things need the list of markdown files.
+    Don't create or remove markdown files in the with block.
+    """
+    global _markdown_files
+    if _markdown_files is not None:
+        # already remembering
+        yield
+        return
+    _markdown_files = list(get_markdown_files())
+    try:
+        yield
+    finally:
+        _markdown_files = None
+
+
+def get_hash(data):
+    """Return a hex digest of a bytes or str object.
+
+    This is used for noticing when a file has changed.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_file_hash(filename):
+    """Like get_hash(), but read the content from a file."""
+    with open(filename, 'rb') as f:
+        return get_hash(f.read())
+
+
+class _HeaderLinkTable(dict):
+    """A str.translate() table for making header links.
+
+    GitHub keeps letters, numbers, - and _, turns spaces into - and
+    removes everything else. Checking that with unicodedata is slow, so
+    each character is checked only once and the result is added to
+    the table.
+    """
+
+    def __missing__(self, codepoint):
+        character = chr(codepoint)
+        if character.isspace():
+            result = '-'
+        elif (character == '-' or
+                unicodedata.category(character)[0] in 'LMN' or
+                unicodedata.category(character) == 'Pc'):
+            # letters, combining marks, numbers, _ and friends
+            result = character
+        else:
+            result = None
+        self[codepoint] = result
+        return result
+
+
+_HEADER_LINK_TABLE = _HeaderLinkTable()
+for _codepoint in range(128):
+    # ASCII characters are the most common, let's check them now
+    _HEADER_LINK_TABLE[_codepoint]
+del _codepoint
+
+
+@functools.lru_cache(maxsize=None)
 def header_link(title):
     """Return a github-style link target for a title.
 
     >>> header_link('Hello there!')
     'hello-there'
+    >>> header_link('Keyword-only arguments')
+    'keyword-only-arguments'
+
+    This doesn't add -1, -2 etc. to the links of titles that appear
+    many times in the same file, use HeaderLinker for that.
+    """
+    return title.lower().translate(_HEADER_LINK_TABLE)
+
+
+class HeaderLinker:
+    """Create header links for the titles of one file like GitHub does.
+
+    GitHub makes links like the-title, the-title-1, the-title-2 etc.
+    when the same title appears many times in the same file.
+
+    >>> linker = HeaderLinker()
+    >>> linker.get_link('Windows')
+    'windows'
+    >>> linker.get_link('Windows')
+    'windows-1'
+    """
+
+    def __init__(self):
+        # {link: how many times it has been used with a suffix}
+        self._occurrences = {}
+
+    def get_link(self, title):
+        """Return a link for the next title in the file."""
+        base = header_link(title)
+        result = base
+        while result in self._occurrences:
+            self._occurrences[base] += 1
+            result = '%s-%d' % (base, self._occurrences[base])
+        self._occurrences[result] = 0
+        return result
+
+
+Header = collections.namedtuple('Header', 'lineno level title link')
+Link = collections.namedtuple('Link', 'lineno column text target image')
+CodeBlock = collections.namedtuple('CodeBlock', 'start end lang code')
+
+
+class Document:
+    """A markdown file that has been read and scanned.
+
+    Use get_document() instead of creating Document objects yourself,
+    it reads each file only once. These attributes are available:
+
+    filename
+        The path that was passed to get_document().
+    text
+        The whole content of the file as a string.
+    hash
+        get_hash(text), useful for noticing when the file changes.
+    lines
+        A list of the lines of the file with newline characters at the
+        ends. Line numbers start at 1 but list indexes start at 0, so
+        the line number n is lines[n-1].
+    headers
+        A list of Header(lineno, level, title, link) namedtuples. The
+        level of ## Title is 2 and the link is from HeaderLinker.
+        Comments in code blocks are not headers.
+    links
+        A list of Link(lineno, column, text, target, image) namedtuples,
+        see find_links(). image is True for ![images](like-this.png).
+    code_blocks
+        A list of CodeBlock(start, end, lang, code) namedtuples. start
+        and end are the line numbers of the ``` lines and lang is the
+        text after the first ```, or None.
+    body
+        The content before the first *** line.
+    footer
+        The content after the first *** line, or None if there is no
+        *** line. update-ends.py writes these.
+    """
+
+    def __init__(self, filename, text):
+        self.filename = filename
+        self.text = text
+        self.hash = get_hash(text)
+        self.lines = text.splitlines(keepends=True)
+
+        self.headers = []
+        self.code_blocks = []
+        linker = HeaderLinker()
+        code_start = None
+        for lineno, line in enumerate(self.lines, start=1):
+            if code_start is not None:
+                # we are in a code block
+                if line.rstrip() == '```':
+                    lang = self.lines[code_start-1].strip()[3:] or None
+                    code = ''.join(self.lines[code_start:lineno-1])
+                    self.code_blocks.append(
+                        CodeBlock(code_start, lineno, lang, code))
+                    code_start = None
+            elif line.startswith('```'):
+                code_start = lineno
+            elif line.startswith('#'):
+                title = line.lstrip('#').strip()
+                level = len(line) - len(line.lstrip('#'))
+                self.headers.append(
+                    Header(lineno, level, title, linker.get_link(title)))
+
+        self.links = [Link(lineno, column, match.group(1), match.group(2),
+                           match.group(0).startswith('!'))
+                      for match, lineno, column in find_links(text)]
+
+        if '\n***\n' in text:
+            where = text.index('\n***\n')
+            self.body = text[:where]
+            self.footer = text[where+len('\n***\n'):]
+        else:
+            self.body = text
+            self.footer = None
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.filename)
+
+
+_documents = {}
+
+
+def get_document(filename):
+    """Read and scan a markdown file, or return it from a cache.
+
+    Each file is read only once, so call forget_document() after
+    changing a file. The files are always UTF-8, whatever the locale
+    is, and the scripts write them back as UTF-8 too.
+    """
+    if filename not in _documents:
+        with open(filename, 'r', encoding='utf-8') as f:
+            _documents[filename] = Document(filename, f.read())
+    return _documents[filename]
+
+
+def forget_document(filename=None):
+    """Make get_document() read a file again next time it's called.
+
+    All files are forgotten if filename is None.
     """
-    # This doesn't do the-title-1, the-title-2 etc. with multiple titles
-    # with same text, but usually this doesn't matter.
-    result = ''
-    for character in title:
-        if character in string.whitespace:
-            result += '-'
-        elif character in string.punctuation:
-            pass
+    if filename is None:
+        _documents.clear()
+    else:
+        _documents.pop(filename, None)
+
+
+def is_external(target):
+    """Check if a link target points to a website."""
+    return target.startswith(('http://', 'https://'))
+
+
+def resolve_link(this_file, target):
+    """Return what a link points to relative to the top of the tutorial.
+
+    >>> resolve_link('basics/loops.md', '../README.md#list-of-contents')
+    'README.md#list-of-contents'
+    >>> resolve_link('basics/loops.md', '#for-loops')
+    'basics/loops.md#for-loops'
+    """
+    if '#' in target:
+        target, title = target.split('#', 1)
+    else:
+        title = None
+    if target:
+        path = posixpath.normpath(
+            posixpath.join(posixpath.dirname(this_file), target))
+        if target.endswith('/'):
+            path += '/'
+    else:
+        # [blabla](#hi)
+        path = this_file
+
+    if title is None:
+        return path
+    return path + '#' + title
+
+
+def get_dependencies(filename):
+    """Return a dictionary of things that a markdown file links to.
+
+    The 'links' and 'images' values are sorted lists of resolve_link()
+    results. Links to websites are ignored.
+    """
+    links = set()
+    images = set()
+    for link in get_document(filename).links:
+        if not is_external(link.target):
+            target = resolve_link(filename, link.target)
+            (images if link.image else links).add(target)
+    return {'links': sorted(links), 'images': sorted(images)}
+
+
+def update_dependency_graph():
+    """Return the dependency graph of all markdown files.
+
+    The graph is a {filename: dependencies} dictionary where each
+    value is a get_dependencies() result with extra 'hash' and 'stat'
+    keys. 'stat' is [size, mtime_ns]. The graph is saved to
+    DEPENDENCY_GRAPH, and when this is called again, only the files
+    whose size or modification time changed are read.
+    """
+    try:
+        with open(DEPENDENCY_GRAPH, 'r') as f:
+            old_graph = json.load(f)
+    except (OSError, ValueError):
+        old_graph = {}
+
+    graph = {}
+    for filename in sorted(get_markdown_files()):
+        stat = os.stat(filename)
+        file_stat = [stat.st_size, stat.st_mtime_ns]
+        old = old_graph.get(filename)
+        if old is not None and old.get('stat') == file_stat:
+            graph[filename] = old
+            continue
+
+        # the file was touched, but its content may be the same
+        file_hash = get_document(filename).hash
+        if old is not None and old['hash'] == file_hash:
+            graph[filename] = dict(old, stat=file_stat)
         else:
-            result += character.lower()
-    return result
+            graph[filename] = get_dependencies(filename)
+            graph[filename]['hash'] = file_hash
+            graph[filename]['stat'] = file_stat
+
+    if graph != old_graph:
+        os.makedirs(os.path.dirname(DEPENDENCY_GRAPH), exist_ok=True)
+        with open(DEPENDENCY_GRAPH, 'w') as f:
+            json.dump(graph, f, indent=2, sort_keys=True)
+    return graph
+
+
+def get_dependents(graph, target):
+    """Return a sorted list of files in the graph that depend on target.
+
+    target can be a file or a title in a file, like 'basics/loops.md'
+    or 'basics/loops.md#for-loops'. A link to a title in a file depends
+    on the file, but a link to the file doesn't depend on its titles.
+    """
+    result = []
+    for filename, dependencies in graph.items():
+        for dependency in dependencies['links'] + dependencies['images']:
+            if (dependency == target or
+                    ('#' not in target and
+                     dependency.startswith(target + '#'))):
+                result.append(filename)
+                break
+    return sorted(result)
 
 
 def askyesno(question, default=True):
@@ -135,22 +462,3 @@ def backup(filename):
         # Everything's fine, we can safely get rid of the backup.
         os.remove(filename + '.backup')
 
-
-def header_link(title):
-    """Return a github-style link target for a title.
-
-    >>> header_link('Hello there!')
-    'hello-there'
-    """
-    # This doesn't handle multiple titles with the same text in the
-    # same file, but usually that's not a problem. GitHub makes
-    # links like the-title, the-title-1, the-title-2 etc.
-    result = ''
-    for character in title:
-        if character in string.whitespace:
-            result += '-'
-        elif character in string.punctuation:
-            pass
-        else:
-            result += character.lower()
-    return result
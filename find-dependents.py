@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# This is free and unencumbered software released into the public
+# domain.
+
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a
+# compiled binary, for any purpose, commercial or non-commercial, and
+# by any means.
+
+# In jurisdictions that recognize copyright laws, the author or
+# authors of this software dedicate any and all copyright interest in
+# the software to the public domain. We make this dedication for the
+# benefit of the public at large and to the detriment of our heirs
+# and successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to
+# this software under copyright law.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# For more information, please refer to <http://unlicense.org>
+
+"""Find the markdown files that link to a file, a title or an image.
+
+For example, this prints the files that would have broken links if the
+"For loops" title in basics/loops.md was renamed:
+
+    python3 find-dependents.py basics/loops.md#for-loops
+"""
+
+import argparse
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=("Print the markdown files that link to a file, a "
+                     "title in a file or an image."))
+    parser.add_argument(
+        'targets', metavar='TARGET', nargs='+',
+        help=("a path relative to the top of the tutorial, optionally "
+              "followed by #title-link, e.g. basics/loops.md#for-loops"))
+    args = parser.parse_args()
+
+    graph = common.update_dependency_graph()
+    for target in args.targets:
+        if len(args.targets) > 1:
+            print(target + ':')
+        dependents = common.get_dependents(graph, target)
+        for filename in dependents:
+            print(filename)
+        if not dependents:
+            print("Nothing depends on %s." % target)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,60 +39,249 @@ This finds links like this...
     [some website](http://github.com/)
     [another website](https://github.com/)
     [local link](#some-title)
+
+Links to websites are checked too with --external, but that needs the
+aiohttp module.
 """
 
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import json
 import os
 import posixpath
+import sys
+import time
+import urllib.parse
+
+try:
+    import aiohttp
+except ImportError:
+    # we can check other links without aiohttp
+    aiohttp = None
 
 import common
 
 
-def check(this_file, target, title, titledict):
-    """Check if a link's target is like it should be.
+EXTERNAL_CACHE = os.path.join(common.CACHE_DIR, 'external-links.json')
+LINKCHECK_CACHE = os.path.join(common.CACHE_DIR, 'linkcheck.json')
+
+# many servers don't like python's default user agent
+USER_AGENT = 'python-tutorial-linkcheck'
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+
+async def _check_url(session, url, retries, timeout, limiter):
+    """Check if a URL works. Return an error message string or "ok"."""
+    result = "ok"
+    for attempt in range(retries + 1):
+        if attempt != 0:
+            # wait a bit longer every time, the server may be busy
+            await asyncio.sleep(0.5 * 2**(attempt - 1))
+        try:
+            # the timeout starts when it's our turn to connect, so
+            # waiting for other URLs of the same host doesn't count
+            async with limiter.acquire(url):
+                status = await asyncio.wait_for(
+                    _get_status(session, url), timeout)
+        except asyncio.TimeoutError:
+            result = "timed out"
+            continue
+        except aiohttp.ClientError as e:
+            result = "cannot connect: %s" % (str(e) or type(e).__name__)
+            continue
+
+        if status < 400:
+            return "ok"
+        result = "HTTP status %d" % status
+        if status != 429 and status < 500:
+            # trying again is not going to help with 404 and friends
+            return result
+    return result
 
-    Return an error message string or "ok".
-    """
-    if target.startswith(('http://', 'https://')):
-        # We don't need this currently, but checking these links could
-        # be added later.
-        return "ok"
 
-    path = posixpath.join(posixpath.dirname(this_file), target)
-    path = posixpath.normpath(path)
+async def _get_status(session, url):
+    # HEAD requests are fast because nothing is downloaded, but
+    # some servers don't support them or respond differently
+    async with session.head(url, allow_redirects=True) as response:
+        status = response.status
+    if status >= 400:
+        async with session.get(url, allow_redirects=True) as response:
+            status = response.status
+    return status
 
-    if not os.path.exists(path):
-        return "doesn't exist"
 
-    if target.endswith('/'):
-        # A directory.
-        if not os.path.isdir(path):
-            return "not a directory"
-    else:
-        # A file.
-        if not os.path.isfile(path):
-            return "not a file"
+class _ConnectionLimiter:
+    """Limit the number of URLs checked at once in total and per host."""
 
-    if title is not None and title not in titledict[path]:
-        return "no title named %s" % title
-    return "ok"
+    def __init__(self, max_connections, max_per_host):
+        self._total = asyncio.Semaphore(max_connections)
+        self._hosts = collections.defaultdict(
+            lambda: asyncio.Semaphore(max_per_host))
 
+    @contextlib.asynccontextmanager
+    async def acquire(self, url):
+        # always the host first, so that URLs waiting for a busy host
+        # don't take the connections of other hosts
+        async with self._hosts[urllib.parse.urlsplit(url).netloc]:
+            async with self._total:
+                yield
 
-def find_titles(filename):
-    """Read titles of a markdown file and return a list of them."""
-    result = []
 
-    with open(filename, 'r') as f:
-        for line in f:
-            if line.startswith('```'):
-                # it's a code block, let's skip to the end of it to
-                # avoid detecting comments as titles
-                while f.readline().rstrip() != '```':
-                    pass
-            if line.startswith('#'):
-                # found a title
-                result.append(common.header_link(line.lstrip('#').strip()))
+async def _check_urls(urls, max_connections, max_per_host, timeout, retries):
+    # _ConnectionLimiter does the limiting instead of the connector,
+    # because the connector's waiting time would count as timeout
+    connector = aiohttp.TCPConnector(limit=0)
+    limiter = _ConnectionLimiter(max_connections, max_per_host)
+    async with aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT}) as session:
+        results = await asyncio.gather(
+            *[_check_url(session, url, retries, timeout, limiter)
+              for url in urls])
+    return dict(zip(urls, results))
 
-    return result
+
+def load_external_cache():
+    try:
+        with open(EXTERNAL_CACHE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_external_cache(cache):
+    os.makedirs(os.path.dirname(EXTERNAL_CACHE), exist_ok=True)
+    with open(EXTERNAL_CACHE, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def check_external(urls, max_connections=50, max_per_host=4, timeout=15,
+                   retries=2, cache_ttl=24*60*60):
+    """Check many http:// and https:// URLs at once.
+
+    The connections are limited to max_connections in total and to
+    max_per_host for each host. Working URLs are saved to a cache and
+    they are not checked again until cache_ttl seconds have passed.
+
+    Return a {url: "ok" or error message} dictionary.
+    """
+    cache = load_external_cache()
+    now = time.time()
+    results = {}
+    unchecked = []
+    for url in sorted(set(urls)):
+        if url in cache and now - cache[url] < cache_ttl:
+            results[url] = "ok"
+        else:
+            unchecked.append(url)
+
+    if unchecked:
+        results.update(asyncio.run(_check_urls(
+            unchecked, max_connections, max_per_host, timeout, retries)))
+
+    for url in unchecked:
+        if results[url] == "ok":
+            cache[url] = now
+        else:
+            # check it again next time, maybe it's fixed then
+            cache.pop(url, None)
+    save_external_cache(cache)
+    return results
+
+
+class TreeSnapshot:
+    """Remember which files and directories exist.
+
+    Each directory is read with os.scandir() when something in it is
+    looked up for the first time, and never again after that.
+    """
+
+    def __init__(self):
+        self._directories = {}     # {directory: {name: is_dir}}
+
+    def _scan(self, directory):
+        if directory not in self._directories:
+            try:
+                with os.scandir(directory or '.') as entries:
+                    self._directories[directory] = {
+                        entry.name: entry.is_dir() for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                self._directories[directory] = {}
+        return self._directories[directory]
+
+    def get_type(self, path):
+        """Return 'file', 'directory' or None if path doesn't exist.
+
+        path must be normalized with posixpath.normpath().
+        """
+        if path == '.':
+            return 'directory'
+        directory, name = posixpath.split(path)
+        if not name:
+            # the root of the file system, like /
+            return 'directory' if os.path.isdir(path) else None
+        if directory and self.get_type(directory) != 'directory':
+            return None
+        is_dir = self._scan(directory).get(name)
+        if is_dir is None:
+            return None
+        return 'directory' if is_dir else 'file'
+
+
+class LinkChecker:
+    """Check if links' targets are like they should be.
+
+    titledict should be a {filename: set of titles} dictionary, and
+    external_results should be a dictionary from check_external(), or
+    None for assuming that links to websites work. Each target is
+    checked only once, even if many files link to it.
+    """
+
+    def __init__(self, titledict, external_results=None):
+        self.titledict = titledict
+        self.external_results = external_results
+        self.tree = TreeSnapshot()
+        self._results = {}     # {(path, is_dir, title): status}
+
+    def check(self, this_file, target, title):
+        """Return an error message string or "ok"."""
+        if common.is_external(target):
+            if self.external_results is None:
+                return "ok"
+            return self.external_results[target]
+
+        path = posixpath.join(posixpath.dirname(this_file), target)
+        key = (posixpath.normpath(path), target.endswith('/'), title)
+        if key not in self._results:
+            self._results[key] = self._check_path(*key)
+        return self._results[key]
+
+    def _check_path(self, path, is_dir, title):
+        path_type = self.tree.get_type(path)
+        if path_type is None:
+            return "doesn't exist"
+
+        if is_dir:
+            # A directory.
+            if path_type != 'directory':
+                return "not a directory"
+        else:
+            # A file.
+            if path_type != 'file':
+                return "not a file"
+
+        if title is not None and title not in self.titledict.get(path, ()):
+            return "no title named %s" % title
+        return "ok"
+
+
+def find_titles(filename):
+    """Read titles of a markdown file and return a list of them."""
+    return [header.link for header in common.get_document(filename).headers]
 
 
 def find_links(this_file):
@@ -102,53 +291,353 @@ def find_links(this_file):
     """
     result = []
 
-    with open(this_file, 'r') as f:
-        for match, lineno in common.find_links(f):
-            target = match.group(2)
-            if '#' in target:
-                file, title = target.split('#', 1)
-                if not file:
-                    # link to this file, [blabla](#hi)
-                    file = posixpath.basename(this_file)
-            else:
-                file = target
-                title = None
+    for link in common.get_document(this_file).links:
+        target = link.target
+        if '#' in target:
+            file, title = target.split('#', 1)
+            if not file:
+                # link to this file, [blabla](#hi)
+                file = posixpath.basename(this_file)
+        else:
+            file = target
+            title = None
 
-            result.append((file, title, lineno))
+        result.append((file, title, link.lineno))
 
     return result
 
 
 def get_line(filename, lineno):
     """Return the lineno'th line of a file."""
-    with open(filename, 'r') as f:
-        for lineno2, line in enumerate(f, start=1):
-            if lineno == lineno2:
-                return line
-    raise ValueError("%s is less than %d lines long" % (filename, lineno))
+    lines = common.get_document(filename).lines
+    if not 1 <= lineno <= len(lines):
+        raise ValueError("%s is less than %d lines long" % (filename, lineno))
+    return lines[lineno-1]
 
 
-def main():
-    print("Searching for titles and links...")
-    titledict = {}      # {filename: [title1, title2, ...]}
-    linkdict = {}       # {filename: [(file, title, lineno), ...])
-    for path in common.get_markdown_files():
-        titledict[path] = find_titles(path)
-        linkdict[path] = find_links(path)
+def scan_file(path):
+    """Return a (titles, links) tuple of find_titles() and find_links()."""
+    return (find_titles(path), find_links(path))
 
-    print("Checking the links...")
+
+def iter_check_all(external_results=None, jobs=1):
+    """Check the links of all markdown files.
+
+    Yield (filename, [(target, title, lineno, status), ...]) pairs
+    sorted by filename. With jobs != 1, the files are read and scanned
+    in that many processes at once (0 means one for each CPU core), and
+    the links are checked when all titles are known.
+    """
+    paths = sorted(common.get_markdown_files())
+    if jobs == 1 or len(paths) <= 1:
+        scans = [scan_file(path) for path in paths]
+    else:
+        workers = jobs or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            chunksize = max(1, len(paths) // (4 * workers))
+            scans = list(executor.map(scan_file, paths, chunksize=chunksize))
+
+    titledict = {path: set(titles) for path, (titles, links)
+                 in zip(paths, scans)}
+    checker = LinkChecker(titledict, external_results)
+    for path, (titles, links) in zip(paths, scans):
+        yield (path, [
+            (target, title, lineno, checker.check(path, target, title))
+            for target, title, lineno in links])
+
+
+def check_all(external_results=None, jobs=1):
+    """Like iter_check_all(), but return a dict."""
+    return dict(iter_check_all(external_results, jobs))
+
+
+def load_linkcheck_cache():
+    try:
+        with open(LINKCHECK_CACHE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}}
+
+    # json doesn't have tuples
+    for info in cache['files'].values():
+        info['links'] = [tuple(link) for link in info['links']]
+    return cache
+
+
+def save_linkcheck_cache(cache):
+    os.makedirs(os.path.dirname(LINKCHECK_CACHE), exist_ok=True)
+    with open(LINKCHECK_CACHE, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def check_incremental(external_results=None):
+    """Like check_all(), but reuse results of the previous run if possible.
+
+    The cache remembers the hash, titles, links and link statuses of
+    each file. The links of a file are checked again if the file
+    changed or if a title it links to was added or removed, and the
+    dependency graph from common.py tells which files link to which
+    titles.
+    Links to other things than markdown files are checked every time
+    because that's cheap, and websites have their own cache.
+
+    Return a (result, rechecked) tuple where result is like in
+    check_all() and rechecked is a set of the files whose links to
+    markdown files were checked.
+    """
+    cache = load_linkcheck_cache()
+    old_files = cache['files']
+    files = {}
+    for path in sorted(common.get_markdown_files()):
+        file_hash = common.get_document(path).hash
+        if path in old_files and old_files[path]['hash'] == file_hash:
+            files[path] = old_files[path]
+        else:
+            files[path] = {
+                'hash': file_hash,
+                'titles': find_titles(path),
+                'links': find_links(path),
+                'results': None,
+            }
+
+    # {target: set of changed titles, or None if the whole file changed}
+    changed_targets = {}
+    for path in old_files.keys() | files.keys():
+        if path not in old_files or path not in files:
+            changed_targets[path] = None
+        else:
+            changed_titles = (set(old_files[path]['titles']) ^
+                              set(files[path]['titles']))
+            if changed_titles:
+                changed_targets[path] = changed_titles
+
+    rechecked = {path for path, info in files.items()
+                 if info['results'] is None}
+    graph = common.update_dependency_graph()
+    for target, changed_titles in changed_targets.items():
+        if changed_titles is None:
+            rechecked.update(common.get_dependents(graph, target))
+        else:
+            for title in changed_titles:
+                rechecked.update(common.get_dependents(
+                    graph, target + '#' + title))
+
+    titledict = {path: set(info['titles']) for path, info in files.items()}
+    checker = LinkChecker(titledict, external_results)
+    result = {}
+    for path, info in files.items():
+        statuses = []
+        for index, (target, title, lineno) in enumerate(info['links']):
+            if (path in rechecked or common.is_external(target) or
+                    not target.endswith('.md')):
+                status = checker.check(path, target, title)
+            else:
+                status = info['results'][index]
+            statuses.append(status)
+
+        info['results'] = statuses
+        result[path] = [link + (status,)
+                        for link, status in zip(info['links'], statuses)]
+
+    save_linkcheck_cache({'files': files})
+    return (result, rechecked)
+
+
+class JsonReport:
+    """Write broken links to a JSON file while they are found.
+
+    The file contains an object like this:
+
+        {"broken_links": [{"file": "basics/loops.md", "line": 12,
+                           "column": 5, "target": "../nope.md",
+                           "reason": "doesn't exist"}, ...],
+         "broken": 1, "total": 436}
+
+    Each link is written when add() is called, so the links are not
+    kept in memory.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'w', encoding='utf-8')
+        self._file.write(self.get_header())
+        self._count = 0
+
+    def add(self, filename, lineno, column, target, reason):
+        if self._count != 0:
+            self._file.write(',')
+        self._file.write('\n    ' + json.dumps(
+            self.get_item(filename, lineno, column, target, reason)))
+        self._count += 1
+
+    def close(self, broken, total):
+        self._file.write('\n' + self.get_footer(broken, total))
+        self._file.close()
+
+    def get_header(self):
+        return '{\n  "broken_links": ['
+
+    def get_item(self, filename, lineno, column, target, reason):
+        return {'file': filename, 'line': lineno, 'column': column,
+                'target': target, 'reason': reason}
+
+    def get_footer(self, broken, total):
+        return '  ],\n  "broken": %d,\n  "total": %d\n}\n' % (broken, total)
+
+
+class SarifReport(JsonReport):
+    """Like JsonReport, but write a SARIF file.
+
+    Many CI systems can show the results of a SARIF file next to the
+    lines of a pull request.
+    """
+
+    def _split_template(self):
+        # json.dumps() makes everything around the results, and the
+        # results go where the placeholder is
+        template = json.dumps({
+            '$schema': SARIF_SCHEMA,
+            'version': '2.1.0',
+            'runs': [{
+                'tool': {'driver': {
+                    'name': 'linkcheck.py',
+                    'rules': [{
+                        'id': 'broken-link',
+                        'shortDescription': {'text': "Broken link"},
+                    }],
+                }},
+                'results': ['RESULTS'],
+            }],
+        }, indent=2)
+        return template.split('"RESULTS"')
+
+    def get_header(self):
+        return self._split_template()[0].rstrip()
+
+    def get_item(self, filename, lineno, column, target, reason):
+        return {
+            'ruleId': 'broken-link',
+            'level': 'error',
+            'message': {'text': "%s: %s" % (target, reason)},
+            'locations': [{'physicalLocation': {
+                'artifactLocation': {'uri': filename},
+                'region': {'startLine': lineno, 'startColumn': column},
+            }}],
+        }
+
+    def get_footer(self, broken, total):
+        return self._split_template()[1].lstrip() + '\n'
+
+
+def print_broken_links(results, reports=()):
+    """Print the broken links of check_all() results.
+
+    results should be an iterable of (filename, linklist) pairs, like
+    check_all().items() or iter_check_all(). The broken links are also
+    added to the JsonReport or SarifReport objects in reports. Return a
+    (broken, total) tuple of link counts.
+    """
     total = 0
     broken = 0
-
-    for filename, linklist in linkdict.items():
-        for target, title, lineno in linklist:
-            status = check(filename, target, title, titledict)
+    for filename, linklist in results:
+        for index, (target, title, lineno, status) in enumerate(linklist):
             if status != "ok":
                 print("  file %s, line %d: %s" % (filename, lineno, status))
                 print("    %s" % get_line(filename, lineno))
+                # the links are in the same order as in the document
+                link = common.get_document(filename).links[index]
+                for report in reports:
+                    report.add(filename, lineno, link.column, link.target,
+                               status)
                 broken += 1
             total += 1
+    return (broken, total)
+
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check for broken links in the markdown files.")
+    parser.add_argument(
+        '--external', action='store_true',
+        help="check links to websites too, this needs aiohttp")
+    parser.add_argument(
+        '--max-connections', metavar='N', type=int, default=50,
+        help=("check at most N websites at a time, "
+              "defaults to %(default)s"))
+    parser.add_argument(
+        '--max-per-host', metavar='N', type=int, default=4,
+        help=("make at most N connections to the same host at a time, "
+              "defaults to %(default)s"))
+    parser.add_argument(
+        '--timeout', metavar='SECONDS', type=float, default=15,
+        help="give up on a website after this, defaults to %(default)s")
+    parser.add_argument(
+        '--retries', metavar='N', type=int, default=2,
+        help=("try failed websites N more times, "
+              "defaults to %(default)s"))
+    parser.add_argument(
+        '--cache-hours', metavar='HOURS', type=float, default=24,
+        help=("don't check working websites again until this many hours "
+              "have passed, defaults to %(default)s"))
+    parser.add_argument(
+        '--cached', action='store_true',
+        help=("remember the results in %s and check only the files "
+              "that changed or link to changed files next time"
+              % LINKCHECK_CACHE))
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=1,
+        help=("read and scan N files at a time in separate processes, 0 "
+              "means one process for each CPU core, defaults to "
+              "%(default)s"))
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help=("also write the broken links to FILE as JSON, with the "
+              "file, line, column, target and reason of each link"))
+    parser.add_argument(
+        '--sarif', metavar='FILE',
+        help="also write the broken links to FILE in SARIF format")
+    args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+    if args.cached and args.jobs != 1:
+        parser.error("--jobs can't be used with --cached")
+
+    if args.external and aiohttp is None:
+        print("aiohttp isn't installed, so --external doesn't work. You",
+              file=sys.stderr)
+        print("can install aiohttp like this:", file=sys.stderr)
+        print(file=sys.stderr)
+        print("    python3 -m pip install aiohttp", file=sys.stderr)
+        sys.exit(1)
+
+    if args.external:
+        urls = [link.target.split('#')[0]
+                for path in common.get_markdown_files()
+                for link in common.get_document(path).links
+                if common.is_external(link.target)]
+        print("Checking %d websites..." % len(set(urls)))
+        external_results = check_external(
+            urls, args.max_connections, args.max_per_host, args.timeout,
+            args.retries, args.cache_hours * 60 * 60)
+    else:
+        external_results = None
+
+    print("Checking the links...")
+    if args.cached:
+        result, rechecked = check_incremental(external_results)
+        print("  Checked links of %d/%d files, the rest came from the cache"
+              % (len(rechecked), len(result)))
+        results = sorted(result.items())
+    else:
+        results = iter_check_all(external_results, args.jobs)
+
+    reports = []
+    if args.json is not None:
+        reports.append(JsonReport(args.json))
+    if args.sarif is not None:
+        reports.append(SarifReport(args.sarif))
+    broken, total = print_broken_links(results, reports)
+    for report in reports:
+        report.close(broken, total)
     print("%d/%d links seem to be broken." % (broken, total))
 
 
@@ -29,43 +29,90 @@
 """Create HTML files of the tutorial."""
 
 import argparse
+import collections
+import contextlib
+import functools
+import gzip
+import importlib.util
+import io
+import itertools
+import json
 import os
 import platform
 import posixpath
+import re
 import shutil
+import struct
 import sys
+import tempfile
 import textwrap
-import webbrowser
+import threading
+import time
+import urllib.parse
+import zlib
 
 if platform.system() == 'Windows':
     python = 'py'
 else:
     python = 'python3'
 
-try:
-    import mistune
-except ImportError:
-    print("mistune isn't installed.", file=sys.stderr)
-    print("You can install it by running this command on a terminal or ")
-    print("command prompt:")
-    print()
-    print("    %s -m pip install mistune" % python)
-    sys.exit(1)
+# importing mistune and pygments takes longer than everything else, so
+# they are imported only when something needs them, see import_mistune()
+# and import_pygments()
+mistune = None
+pygments = None
+
+import common
+
+
+def find_mistune():
+    """Return the path of mistune's __init__.py without importing it.
+
+    This exits with an error message if mistune isn't installed.
+    """
+    spec = importlib.util.find_spec('mistune')
+    if spec is None:
+        print("mistune isn't installed.", file=sys.stderr)
+        print("You can install it by running this command on a terminal or ")
+        print("command prompt:")
+        print()
+        print("    %s -m pip install mistune" % python)
+        sys.exit(1)
+    return spec.origin
+
+
+def import_mistune():
+    global mistune
+    if mistune is None:
+        find_mistune()
+        import mistune
+
+
+def has_pygments():
+    """Check if pygments is installed without importing it."""
+    # we can work without pygments, but we won't get colors
+    return importlib.util.find_spec('pygments') is not None
 
-try:
+
+def import_pygments():
+    """Import the parts of pygments that make-html.py uses."""
+    global pygments
     import pygments.formatters
     import pygments.lexers
     import pygments.style
     import pygments.styles
     import pygments.token
-except ImportError:
-    # we can work without pygments, but we won't get colors
-    pygments = None
+    import pygments.util
 
-import common
 
+@functools.lru_cache(maxsize=None)
+def get_tutorial_style():
+    """Return the default Pygments style class."""
+    # pygments.formatters and pygments.lexers are not needed for this
+    global pygments
+    import pygments.style
+    import pygments.token
 
-if pygments is not None:
     class TutorialStyle(pygments.style.Style):
         background_color = '#111111'
         styles = {
@@ -76,6 +123,121 @@ if pygments is not None:
             pygments.token.Name.Exception: 'bold #ff0000',
         }
 
+    # pickle finds the class with the module's __getattr__() when it's
+    # sent to a --jobs process
+    TutorialStyle.__qualname__ = 'TutorialStyle'
+    return TutorialStyle
+
+
+def __getattr__(name):
+    # TutorialStyle is created when it's used for the first time
+    if name == 'TutorialStyle':
+        return get_tutorial_style()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+# Increment this when the HTML output changes in a way that the manifest
+# of an incremental build can't notice otherwise.
+RENDERER_VERSION = 1
+
+MANIFEST_NAME = '.manifest.json'
+
+# files copied to the output directory as is, (source, destination) pairs
+OTHER_FILES = [('LICENSE', 'LICENSE.txt'), ('html-style.css', 'style.css')]
+
+# files in these directories are copied to the output directory if some
+# page links to them
+ASSET_DIRS = ['images']
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CACHE = os.path.join(common.CACHE_DIR, 'png')
+
+# --precompress makes .gz and .br files of files with these extensions
+PRECOMPRESS_EXTENSIONS = ('.html', '.css', '.txt')
+PRECOMPRESS_MANIFEST = '.precompressed.json'
+
+# --search-index writes the index here, see update_search_index()
+SEARCH_DIR = 'search'
+SEARCH_STATE = '.search.json'
+
+# the search page loads only the shards of the words being searched for
+SEARCH_BODY = """\
+<h1>Search</h1>
+<form id="search-form">
+  <input id="search-input" type="search" autofocus>
+  <input type="submit" value="Search">
+</form>
+<ul id="search-results"></ul>
+<script>
+function getJSON(url) {
+  return fetch(url).then(function(response) {
+    return response.ok ? response.json() : {};
+  });
+}
+
+function decode(deltas) {
+  var result = [], id = 0;
+  for (var i = 0; i < deltas.length; i++) {
+    id += deltas[i];
+    result.push(id);
+  }
+  return result;
+}
+
+document.getElementById('search-form').onsubmit = function(event) {
+  event.preventDefault();
+  var query = document.getElementById('search-input').value.toLowerCase();
+  var words = query.match(/[\\p{L}\\p{N}_]{%(min_length)d,}/gu) || [];
+  var shards = words.map(function(word) {
+    return getJSON('search/' + encodeURIComponent(word.slice(0, %(prefix)d))
+                   + '.json');
+  });
+  Promise.all([getJSON('search/docs.json')].concat(shards))
+         .then(function(results) {
+    var docs = results[0], ids = null;
+    words.forEach(function(word, i) {
+      var found = decode(results[i + 1][word] || []);
+      ids = (ids === null) ? found : ids.filter(function(id) {
+        return found.indexOf(id) !== -1;
+      });
+    });
+    var list = document.getElementById('search-results');
+    list.innerHTML = '';
+    (ids || []).forEach(function(id) {
+      var item = document.createElement('li'),
+          link = document.createElement('a');
+      link.href = docs[id][0];
+      link.textContent = docs[id][1];
+      item.appendChild(link);
+      list.appendChild(item);
+    });
+    if (ids !== null && ids.length === 0) {
+      list.innerHTML = '<li>Nothing found.</li>';
+    }
+  });
+};
+</script>
+"""
+
+# --compact uses these classes for diffs instead of <font> tags
+COMPACT_DIFF_CSS = """\
+.diff-added { color: green; }
+.diff-removed { color: red; }
+"""
+
+# --compact removes whitespace around these tags, see minify_html()
+BLOCK_TAGS = ('html|head|body|meta|title|link|script|div|p|h[1-6]|ul|ol|li|'
+              'table|thead|tbody|tr|th|td|blockquote|hr|br')
+
+# TutorialRenderer.block_code() returns this instead of highlighted code
+CODE_PLACEHOLDER = '\0code%d\0'
+
+# --watch adds this to the pages it serves
+RELOAD_SCRIPT = """\
+<script>
+new EventSource('/__reload__').onmessage = function() { location.reload(); };
+</script>
+"""
 
 HTML_TEMPLATE = """\
 <!DOCTYPE html>
@@ -83,14 +245,221 @@ HTML_TEMPLATE = """\
   <head>
     <meta charset="UTF-8">
     <title>{title}</title>
-    <link rel="stylesheet" type="text/css" href="{stylefile}">
+    <link rel="stylesheet" type="text/css" href="{stylefile}">{extra_head}
   </head>
   <body>
-    {body}
+    {search_link}{body}
   </body>
 </html>
 """
 
+# pages link to search.html like this with --search-index
+SEARCH_LINK = '<p><a href="%s">Search the tutorial</a></p>\n    '
+
+
+class Profiler:
+    """Measure how much time and memory the phases of a build take.
+
+    Phases can be nested, e.g. 'highlight' runs inside 'markdown', and
+    the time and memory of the inner phase are also included in the
+    outer phase. Memory is measured only if trace_memory is True,
+    because tracemalloc makes everything much slower.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}        # {name: {'calls': n, 'seconds': s, ...}}
+        self.pages = {}         # {markdownfile: {'seconds': s, ...}}
+        self.code_blocks = []   # [{'page': markdownfile, ...}, ...]
+        self.current_page = None
+        self.last_seconds = None    # time of the latest phase
+        self.last_peak = None       # peak memory of the latest phase
+        # [memory when it started, peak so far] lists of the phases
+        # running now
+        self._running = []
+
+    def _update_peaks(self):
+        import tracemalloc
+        # tracemalloc has only one peak, so the running phases get the
+        # peak so far and then it's reset for the next phase
+        peak = tracemalloc.get_traced_memory()[1]
+        for running in self._running:
+            running[1] = max(running[1], peak - running[0])
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        stats = self.phases.setdefault(
+            name, {'calls': 0, 'seconds': 0, 'peak_memory': 0})
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._update_peaks()
+            running = [tracemalloc.get_traced_memory()[0], 0]
+        else:
+            running = [0, 0]
+        self._running.append(running)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if self.trace_memory:
+                self._update_peaks()
+            self._running.pop()
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['peak_memory'] = max(stats['peak_memory'], running[1])
+            self.last_seconds = seconds
+            self.last_peak = running[1]
+
+    @contextlib.contextmanager
+    def page(self, markdownfile):
+        """Like phase('render'), but also remember the page."""
+        self.current_page = markdownfile
+        with self.phase('render'):
+            yield
+        self.pages[markdownfile] = {'seconds': self.last_seconds}
+        if self.trace_memory:
+            self.pages[markdownfile]['peak_memory'] = self.last_peak
+
+    @contextlib.contextmanager
+    def code_block(self, code, lexer):
+        """Like phase('highlight'), but also remember the code block."""
+        with self.phase('highlight'):
+            yield
+        self.code_blocks.append({
+            'page': self.current_page,
+            'first_line': code.split('\n')[0],
+            'lexer': type(lexer).__name__,
+            'lines': code.count('\n'),
+            'seconds': self.last_seconds,
+        })
+
+    def get_report(self):
+        """Return everything as a JSON-compatible dictionary.
+
+        The peak memory of phases and pages is how much more memory was
+        in use at the peak than when the phase started. It's 0 if
+        memory wasn't traced.
+        """
+        pages = sorted(self.pages.items(),
+                       key=(lambda item: -item[1]['seconds']))
+        return {
+            'memory_traced': self.trace_memory,
+            'phases': self.phases,
+            'pages': [dict(info, page=page) for page, info in pages],
+            'code_blocks': sorted(self.code_blocks,
+                                  key=(lambda block: -block['seconds'])),
+        }
+
+    def _format_memory(self, info):
+        if not self.trace_memory:
+            return ''
+        return ', peak memory +%.1fMB' % (info['peak_memory'] / 1024 / 1024)
+
+    def print_report(self, count=10):
+        report = self.get_report()
+        if self.trace_memory:
+            print("Memory was traced, so everything was slower than usual.")
+        print("Phases:")
+        for name, stats in self.phases.items():
+            print("  %-10s %8.1f ms in %d calls%s"
+                  % (name, stats['seconds'] * 1000, stats['calls'],
+                     self._format_memory(stats)))
+
+        print("Slowest pages:")
+        for page in report['pages'][:count]:
+            print("  %8.1f ms  %s%s" % (page['seconds'] * 1000, page['page'],
+                                        self._format_memory(page)))
+
+        print("Slowest code blocks:")
+        for block in report['code_blocks'][:count]:
+            print("  %8.1f ms  %s, %d lines starting with %.40r"
+                  % (block['seconds'] * 1000, block['page'],
+                     block['lines'], block['first_line']))
+
+
+# set by main() when --profile is used
+profiler = None
+
+
+def profile_phase(name):
+    """Return profiler.phase(name) or a context manager that does nothing."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
+
+
+class HighlightCache:
+    """Highlighted code blocks saved to files named by a hash.
+
+    The hash is computed from the code, the lexer and the style, so
+    there's no need to ever invalidate anything. When the files take
+    more than max_size bytes, the least recently used files are
+    removed by cleanup().
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, code, lexer, pygments_style, compact=False):
+        # inline styles and CSS classes give different HTML
+        mode = 'classes' if compact else 'inline'
+        return common.get_hash('\0'.join([
+            pygments.__version__, type(lexer).__name__,
+            get_style_key(pygments_style), mode, code]))
+
+    def get(self, key):
+        """Return cached HTML or None."""
+        path = os.path.join(self.directory, key + '.html')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = f.read()
+            # cleanup() removes files with the oldest modification times
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, html):
+        os.makedirs(self.directory, exist_ok=True)
+        # other processes may use the cache at the same time, so the
+        # file must appear all at once
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(temp_path, os.path.join(self.directory, key + '.html'))
+
+    def cleanup(self):
+        """Remove least recently used files until max_size is not exceeded.
+
+        Return the number of removed files.
+        """
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.name.endswith('.html')]
+        except FileNotFoundError:
+            return 0
+
+        stats = {entry.path: entry.stat() for entry in entries}
+        total = sum(stat.st_size for stat in stats.values())
+        removed = 0
+        for path in sorted(stats, key=lambda path: stats[path].st_mtime):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= stats[path].st_size
+            removed += 1
+        return removed
+
 
 def mkdir_and_open(filename, mode):
     """Like open(), but make directories as needed."""
@@ -112,20 +481,48 @@ def fix_filename(filename):
     return filename
 
 
-class TutorialRenderer(mistune.HTMLRenderer):
+@functools.lru_cache(maxsize=None)
+def get_renderer_class():
+    """Return a subclass of TutorialRenderer and mistune.HTMLRenderer."""
+    import_mistune()
+    return type('TutorialRenderer', (TutorialRenderer, mistune.HTMLRenderer),
+                {})
+
 
-    def __init__(self, pygments_style):
+class TutorialRenderer:
+    """The methods of our mistune renderer.
+
+    This doesn't inherit from mistune.HTMLRenderer because mistune is
+    imported only when something is rendered. Use get_renderer_class()
+    to get a class that can be used as a mistune renderer.
+    """
+
+    def __init__(self, pygments_styles, highlight_cache=None,
+                 compact=False):
         super().__init__()
-        self.pygments_style = pygments_style
-        self.title = None   # will be set by header()
+        if pygments_styles[0] is not None:
+            import_pygments()
+        self.pygments_styles = pygments_styles
+        self.highlight_cache = highlight_cache
+        self.compact = compact
+        self.title = None   # will be set by heading()
+        # code blocks are highlighted with every style, and each block
+        # is replaced with CODE_PLACEHOLDER until we know which style
+        # the page is for, see _render_page()
+        self.highlighted = []
+        self.header_linker = common.HeaderLinker()
 
-    def header(self, text, level, raw):
-        """Create a header that is also a link and a # link target."""
-        # "# raw"
+    def heading(self, text, level):
+        """Create a heading that is also a link and a # link target."""
+        import html     # not at the top, many functions have html variables
+        # "# title"
         if level == 1:
             self.title = text
-        target = common.header_link(raw)
-        content = super().header(text, level, raw)
+        # text is HTML, but links are made from the title as it's
+        # written in the markdown file, like common.Document does
+        title = html.unescape(re.sub(r'<[^>]*>', '', text))
+        target = self.header_linker.get_link(title)
+        content = super().heading(text, level)
         return '<a name="{0}" href="#{0}">{1}</a>'.format(target, content)
 
     def link(self, link, title, text):
@@ -145,15 +542,29 @@ class TutorialRenderer(mistune.HTMLRenderer):
 
     def block_code(self, code, lang=None):
         """Highlight Python code blocks with Pygments if it's installed."""
-        if lang == 'python' and pygments is not None:
+        if lang == 'python' and self.pygments_styles[0] is not None:
             # we can highlight it
             if code.startswith('>>> '):
                 lexer = pygments.lexers.PythonConsoleLexer(python3=True)
             else:
                 lexer = pygments.lexers.Python3Lexer()
-            formatter = pygments.formatters.HtmlFormatter(
-                style=self.pygments_style, noclasses=True)
-            return pygments.highlight(code, lexer, formatter)
+            self.highlighted.append(self.highlight(code, lexer))
+            return CODE_PLACEHOLDER % (len(self.highlighted) - 1)
+
+        elif lang == 'diff' and self.compact:
+            # like below, but the colors are in the code stylesheet
+            result = []
+            for line in code.split('\n'):
+                line = line.strip()
+                if line.startswith('+'):
+                    result.append('<p class="diff-added">%s</p>'
+                                  % mistune.escape(line.strip('+')))
+                elif line.startswith('-'):
+                    result.append('<p class="diff-removed">%s</p>'
+                                  % mistune.escape(line.strip('-')))
+                elif line:
+                    result.append('<p>%s</p>' % mistune.escape(line))
+            return ''.join(result)
 
         elif lang == 'diff':
             # http://stackoverflow.com/a/39413824
@@ -178,6 +589,49 @@ class TutorialRenderer(mistune.HTMLRenderer):
             # we can't highlight it
             return super().block_code(code, lang)
 
+    def highlight(self, code, lexer):
+        """Return a list of HTML of the code, one for each style."""
+        if profiler is None:
+            return self._highlight(code, lexer)
+        with profiler.code_block(code, lexer):
+            return self._highlight(code, lexer)
+
+    def _highlight(self, code, lexer):
+        tokens = None
+        results = []
+        for style in self.pygments_styles:
+            if self.highlight_cache is None:
+                key = None
+            else:
+                key = self.highlight_cache.get_key(
+                    code, lexer, style, self.compact)
+                result = self.highlight_cache.get(key)
+                if result is not None:
+                    results.append(result)
+                    continue
+
+            # the lexer is the slow part, so run it only once and only
+            # if some style isn't cached
+            if tokens is None:
+                tokens = list(lexer.get_tokens(code))
+
+            # compact pages use CSS classes from get_code_css()
+            formatter = pygments.formatters.HtmlFormatter(
+                style=style, noclasses=not self.compact)
+            styled_tokens = tokens
+            if self.compact:
+                # HtmlFormatter puts a class on every token, even if the
+                # style doesn't color it, but Text tokens get no <span>
+                styled_tokens = [
+                    (ttype if is_styled(formatter.style, ttype)
+                     else pygments.token.Text, value)
+                    for ttype, value in tokens]
+            result = pygments.format(styled_tokens, formatter)
+            if key is not None:
+                self.highlight_cache.put(key, result)
+            results.append(result)
+        return results
+
     def image(self, src, title, text):
         """Return an image inside a link."""
         result = super().image(src, title, text)
@@ -189,6 +643,15 @@ class TutorialRenderer(mistune.HTMLRenderer):
         return result.replace('<table>', '<table border="1">', 1)
 
 
+@functools.lru_cache(maxsize=None)
+def is_styled(style, ttype):
+    """Check if a Pygments style class changes how a token type looks."""
+    info = style.style_for_token(ttype)
+    return any(info.get(key) for key in [
+        'color', 'bgcolor', 'border', 'bold', 'italic', 'underline',
+        'roman', 'sans', 'mono'])
+
+
 def wrap_text(text):
     """Like textwrap.fill, but respects newlines."""
     result = []
@@ -197,11 +660,1354 @@ def wrap_text(text):
     return '\n'.join(result)
 
 
+def get_code_stylesheet(pygments_style):
+    """Return the name of the file that get_code_css() is written to."""
+    name = get_style_name(pygments_style) or 'plain'
+    return 'code-%s.css' % name.lower()
+
+
+def get_code_css(pygments_style):
+    """Return CSS for the code examples of --compact pages."""
+    if pygments_style is None:
+        return COMPACT_DIFF_CSS
+    import_pygments()
+    formatter = pygments.formatters.HtmlFormatter(style=pygments_style)
+    lines = formatter.get_style_defs('.highlight').splitlines()
+    # the other code blocks must look like they do without --compact
+    lines = ['.highlight ' + line if line.startswith('pre ') else line
+             for line in lines]
+    return '\n'.join(lines) + '\n' + COMPACT_DIFF_CSS
+
+
+def minify_html(html):
+    """Remove unnecessary whitespace outside <pre> elements.
+
+    Whitespace is removed around the tags that start new lines anyway,
+    and other runs of whitespace are replaced with one space.
+    """
+    parts = re.split(r'(<pre[ >].*?</pre>)', html, flags=re.DOTALL)
+    for index in range(0, len(parts), 2):
+        part = re.sub(r'\s+', ' ', parts[index])
+        part = re.sub(r' ?(</?(?:%s)\b[^>]*>) ?' % BLOCK_TAGS, r'\1', part)
+        parts[index] = part
+    return ''.join(parts)
+
+
+def render_page(markdownfile, pygments_style, highlight_cache=None,
+                compact=False, search_link=False):
+    """Convert a markdown file to a complete HTML page and return it.
+
+    If compact is True, the code examples use CSS classes from the
+    get_code_stylesheet() file and the HTML is minified. If search_link
+    is True, the page links to the search.html of --search-index.
+    """
+    return render_page_styles(markdownfile, [pygments_style],
+                              highlight_cache, compact, search_link)[0]
+
+
+def render_page_styles(markdownfile, pygments_styles, highlight_cache=None,
+                       compact=False, search_link=False):
+    """Like render_page(), but return a list of pages, one for each style.
+
+    The markdown is parsed and the code examples are tokenized only
+    once, and only the highlighted HTML is created for every style.
+    """
+    if profiler is None:
+        return _render_page(markdownfile, pygments_styles, highlight_cache,
+                            compact, search_link)
+    with profiler.page(markdownfile):
+        return _render_page(markdownfile, pygments_styles, highlight_cache,
+                            compact, search_link)
+
+
+def _render_page(markdownfile, pygments_styles, highlight_cache, compact,
+                 search_link):
+    with profile_phase('read'):
+        markdown = common.get_document(markdownfile).text
+    renderer = get_renderer_class()(pygments_styles, highlight_cache,
+                                    compact)
+    with profile_phase('markdown'):
+        body = mistune.markdown(markdown, renderer=renderer)
+    directory = posixpath.dirname(fix_filename(markdownfile))
+    stylefile = posixpath.relpath('style.css', directory)
+    if search_link:
+        search_link = SEARCH_LINK % posixpath.relpath('search.html',
+                                                      directory)
+    else:
+        search_link = ''
+
+    results = []
+    for index, pygments_style in enumerate(pygments_styles):
+        if compact:
+            extra_head = (
+                '<link rel="stylesheet" type="text/css" href="%s">'
+                % posixpath.relpath(get_code_stylesheet(pygments_style),
+                                    directory))
+        else:
+            extra_head = ''
+
+        with profile_phase('template'):
+            # print() used to add this newline when writing the file
+            result = HTML_TEMPLATE.format(
+                title=renderer.title,
+                body=body,
+                stylefile=stylefile,
+                extra_head=extra_head,
+                search_link=search_link,
+            ) + '\n'
+            if renderer.highlighted:
+                # see CODE_PLACEHOLDER
+                result = re.sub(
+                    r'\0code(\d+)\0',
+                    lambda match: renderer.highlighted[
+                        int(match.group(1))][index],
+                    result)
+        if compact:
+            with profile_phase('minify'):
+                result = minify_html(result)
+        results.append(result)
+    return results
+
+
+# the HighlightCache of a worker process, see _render_in_worker()
+_worker_cache = None
+
+
+def _render_in_worker(markdownfile, pygments_styles, cache_settings,
+                      compact, search_link):
+    """Call render_page_styles() in a worker process.
+
+    Return (htmls, hits, misses) so that the main process can add the
+    hits and misses to its own HighlightCache.
+    """
+    global _worker_cache
+
+    if cache_settings is None:
+        return (render_page_styles(markdownfile, pygments_styles, None,
+                                   compact, search_link), 0, 0)
+
+    if _worker_cache is None:
+        _worker_cache = HighlightCache(*cache_settings)
+    hits, misses = _worker_cache.hits, _worker_cache.misses
+    htmls = render_page_styles(markdownfile, pygments_styles, _worker_cache,
+                               compact, search_link)
+    return (htmls, _worker_cache.hits - hits, _worker_cache.misses - misses)
+
+
+def render_pages(markdownfiles, pygments_style, jobs=1,
+                 highlight_cache=None, compact=False, search_link=False):
+    """Render markdown files, possibly in several processes at once.
+
+    Yield (markdownfile, html) pairs in the same order as the files
+    are given, so the result doesn't depend on the number of jobs.
+    """
+    results = render_pages_styles(markdownfiles, [pygments_style], jobs,
+                                  highlight_cache, compact, search_link)
+    for markdownfile, htmls in results:
+        yield (markdownfile, htmls[0])
+
+
+def render_pages_styles(markdownfiles, pygments_styles, jobs=1,
+                        highlight_cache=None, compact=False,
+                        search_link=False):
+    """Like render_pages(), but yield (markdownfile, htmls) pairs.
+
+    See render_page_styles().
+    """
+    markdownfiles = list(markdownfiles)
+    if jobs == 1 or len(markdownfiles) <= 1:
+        results = (render_page_styles(markdownfile, pygments_styles,
+                                      highlight_cache, compact, search_link)
+                   for markdownfile in markdownfiles)
+        yield from zip(markdownfiles, results)
+        return
+
+    if highlight_cache is None:
+        cache_settings = None
+    else:
+        cache_settings = (highlight_cache.directory, highlight_cache.max_size)
+
+    import concurrent.futures
+    workers = jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # chunks of several files at a time keep the workers busy
+        # without sending every file to a different process
+        chunksize = max(1, len(markdownfiles) // (4 * workers))
+        results = executor.map(
+            _render_in_worker, markdownfiles,
+            itertools.repeat(pygments_styles),
+            itertools.repeat(cache_settings), itertools.repeat(compact),
+            itertools.repeat(search_link), chunksize=chunksize)
+        for markdownfile, (htmls, hits, misses) in zip(markdownfiles,
+                                                       results):
+            if highlight_cache is not None:
+                highlight_cache.hits += hits
+                highlight_cache.misses += misses
+            yield (markdownfile, htmls)
+
+
+def print_progress(number, total, markdownfile, htmlfile, end='\n'):
+    print('  [%*d/%d] %-30.30s  -->  %-30.30s'
+          % (len(str(total)), number, total, markdownfile, htmlfile),
+          end=end)
+
+
+def get_style_name(pygments_style):
+    """Return a string that identifies a --pygments-style value."""
+    if pygments_style is None:
+        return None
+    if isinstance(pygments_style, str):
+        return pygments_style
+    # it's a Style subclass, like TutorialStyle
+    return pygments_style.__name__
+
+
+@functools.lru_cache(maxsize=None)
+def get_style_key(pygments_style):
+    """Return a string that changes when a --pygments-style changes.
+
+    For a custom Style subclass, this includes everything that the
+    formatter uses, like background_color and the token styles.
+    """
+    if isinstance(pygments_style, str):
+        # the pygments version is in the key of HighlightCache anyway
+        return pygments_style
+    import_pygments()
+    formatter = pygments.formatters.HtmlFormatter(style=pygments_style)
+    css = formatter.get_style_defs('.highlight')
+    return '%s %s' % (pygments_style.__name__, common.get_hash(css))
+
+
+def get_renderer_hash():
+    """Return a hash that changes when the rendering code changes.
+
+    The scripts themselves are hashed, so editing HTML_TEMPLATE or
+    TutorialRenderer makes incremental builds render everything again.
+    """
+    # mistune's __init__.py contains its version, and reading that is
+    # faster than importing mistune
+    parts = [str(RENDERER_VERSION)]
+    for filename in [__file__, common.__file__, find_mistune()]:
+        parts.append(common.get_file_hash(filename))
+    return common.get_hash('\n'.join(parts))
+
+
+def load_manifest(outdir):
+    """Read the manifest of an incremental build.
+
+    Return None if outdir doesn't contain a valid manifest.
+    """
+    try:
+        with open(os.path.join(outdir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(outdir, manifest):
+    with mkdir_and_open(os.path.join(outdir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def remove_output(outdir, htmlfile):
+    """Remove an output file and the directories that became empty."""
+    path = os.path.join(outdir, htmlfile)
+    if os.path.isfile(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    while os.path.normpath(directory) != os.path.normpath(outdir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # not empty
+            break
+        directory = os.path.dirname(directory)
+
+
+def build_incremental(outdir, pygments_style, jobs=1, highlight_cache=None,
+                      compact=False, search_link=False):
+    """Render the pages whose inputs have changed since the last build.
+
+    The manifest in outdir remembers hashes of each markdown file and
+    the HTML file made from it, so pages are rendered again if the
+    markdown file changes, the HTML file is changed or deleted, or the
+    style or the rendering code changes. HTML files of removed markdown
+    files are deleted.
+
+    Return a list of the markdown files that were rendered.
+    """
+    old_manifest = load_manifest(outdir)
+    manifest = {
+        'renderer': get_renderer_hash(),
+        'style': get_style_name(pygments_style),
+        'compact': compact,
+        'search_link': search_link,
+        'pages': {},
+    }
+    if (old_manifest is None or
+            old_manifest.get('renderer') != manifest['renderer'] or
+            old_manifest.get('style') != manifest['style'] or
+            old_manifest.get('compact', False) != compact or
+            old_manifest.get('search_link', False) != search_link):
+        old_pages = {}
+    else:
+        old_pages = old_manifest['pages']
+
+    source_hashes = {}
+    rendered = []
+    for markdownfile in sorted(common.get_markdown_files()):
+        fixed_file = fix_filename(markdownfile)
+        htmlfile = os.path.join(outdir, fixed_file)
+        source_hashes[markdownfile] = common.get_document(markdownfile).hash
+
+        old = old_pages.get(markdownfile)
+        if (old is not None and
+                old['source'] == source_hashes[markdownfile] and
+                old['output'] == fixed_file and
+                os.path.isfile(htmlfile) and
+                common.get_file_hash(htmlfile) == old['output_hash']):
+            # nothing changed
+            manifest['pages'][markdownfile] = old
+        else:
+            rendered.append(markdownfile)
+
+    results = render_pages(rendered, pygments_style, jobs, highlight_cache,
+                           compact, search_link)
+    for number, (markdownfile, html) in enumerate(results, start=1):
+        fixed_file = fix_filename(markdownfile)
+        htmlfile = os.path.join(outdir, fixed_file)
+        print_progress(number, len(rendered), markdownfile, htmlfile)
+        with profile_phase('write'), mkdir_and_open(htmlfile, 'w') as f:
+            f.write(html)
+        manifest['pages'][markdownfile] = {
+            'source': source_hashes[markdownfile],
+            'output': fixed_file,
+            'output_hash': common.get_hash(html),
+        }
+
+    if old_manifest is not None:
+        for markdownfile, old in old_manifest['pages'].items():
+            if markdownfile not in manifest['pages']:
+                print("  Removing %s, %s is gone"
+                      % (old['output'], markdownfile))
+                remove_output(outdir, old['output'])
+
+    manifest['pages'] = dict(sorted(manifest['pages'].items()))
+    save_manifest(outdir, manifest)
+    print("  %d/%d pages needed rendering"
+          % (len(rendered), len(manifest['pages'])))
+    return rendered
+
+
+def get_referenced_assets(graph):
+    """Return a set of the asset files that pages link to.
+
+    The graph comes from common.update_dependency_graph(). Its images
+    and links are the same targets that TutorialRenderer.image() and
+    TutorialRenderer.link() get.
+    """
+    result = set()
+    for dependencies in graph.values():
+        for target in dependencies['images'] + dependencies['links']:
+            path = target.split('#')[0]
+            if (path.split('/')[0] in ASSET_DIRS and
+                    os.path.isfile(path)):
+                result.add(path)
+    return result
+
+
+def optimize_png(data):
+    """Compress a PNG image better without changing its pixels.
+
+    The image data of a PNG file is zlib-compressed, and many programs
+    don't compress it as well as they could. Return the recompressed
+    image, or the original data if recompressing doesn't help.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+
+    # a PNG file consists of chunks with this format:
+    #   length (4 bytes), type (4 bytes), data (length bytes), crc (4 bytes)
+    chunks = []
+    image_data = []
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset+8])
+        chunk_data = data[offset+8:offset+8+length]
+        if kind == b'IDAT':
+            if not image_data:
+                # all IDAT chunks are replaced with one chunk here
+                chunks.append((b'IDAT', None))
+            image_data.append(chunk_data)
+        else:
+            chunks.append((kind, chunk_data))
+        offset += length + 12
+
+    try:
+        raw = zlib.decompress(b''.join(image_data))
+    except zlib.error:
+        # broken image, let's not touch it
+        return data
+
+    best = None
+    for strategy in [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED]:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        compressed = compressor.compress(raw) + compressor.flush()
+        if best is None or len(compressed) < len(best):
+            best = compressed
+
+    result = [PNG_SIGNATURE]
+    for kind, chunk_data in chunks:
+        if chunk_data is None:
+            chunk_data = best
+        result.append(struct.pack('>I', len(chunk_data)) + kind + chunk_data +
+                      struct.pack('>I', zlib.crc32(kind + chunk_data)))
+    result = b''.join(result)
+    if len(result) < len(data):
+        return result
+    return data
+
+
+def get_optimized_png(filename):
+    """Return the path of an optimize_png() result for a file.
+
+    The results are saved to PNG_CACHE with names based on the hashes
+    of the original images, so each image is optimized only once.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    path = os.path.join(PNG_CACHE, common.get_hash(data) + '.png')
+    if not os.path.exists(path):
+        os.makedirs(PNG_CACHE, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=PNG_CACHE, suffix='.tmp')
+        with open(fd, 'wb') as f:
+            f.write(optimize_png(data))
+        os.replace(temp_path, path)
+    return path
+
+
+def link_or_copy(source, destination):
+    """Make destination a hard link to source, or a copy if that fails.
+
+    Return False if destination was already up to date.
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return False
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+        if (source_stat.st_size == destination_stat.st_size and
+                source_stat.st_mtime_ns == destination_stat.st_mtime_ns):
+            # copy2() copied the modification time, so this is a copy
+            # of the same file
+            return False
+        os.remove(destination)
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # hard links don't work on this file system or between these
+        # file systems
+        shutil.copy2(source, destination)
+    return True
+
+
+def copy_assets(outdir, assets, optimize_images=False):
+    """Update the asset files in outdir.
+
+    Files that haven't changed are not copied again, and files that are
+    no longer in assets are removed. If optimize_images is True, PNG
+    images go through optimize_png() first.
+
+    Return a (copied, removed) tuple of lists.
+    """
+    copied = []
+    for path in sorted(assets):
+        source = path
+        if optimize_images and path.endswith('.png'):
+            source = get_optimized_png(path)
+        if link_or_copy(source, os.path.join(outdir, path)):
+            copied.append(path)
+
+    removed = []
+    for directory in ASSET_DIRS:
+        for root, dirs, files in os.walk(os.path.join(outdir, directory)):
+            for file in files:
+                path = os.path.relpath(os.path.join(root, file), outdir)
+                path = path.replace(os.sep, '/')
+                if path not in assets:
+                    remove_output(outdir, path)
+                    removed.append(path)
+    return (copied, sorted(removed))
+
+
+def copy_other_files(outdir, optimize_images=False):
+    """Copy the images that the pages use and OTHER_FILES to outdir.
+
+    The code stylesheet of --compact isn't copied, use
+    write_code_stylesheet() for that.
+    """
+    with profile_phase('copy'):
+        assets = get_referenced_assets(common.update_dependency_graph())
+        copied, removed = copy_assets(outdir, assets, optimize_images)
+        print("  %d/%d files were copied, %d old files were removed"
+              % (len(copied), len(assets), len(removed)))
+        for source, destination in OTHER_FILES:
+            destination = os.path.join(outdir, destination)
+            if (os.path.exists(destination) and
+                    os.path.samefile(source, destination)):
+                # --watch used to make hard links to these, and
+                # shutil.copy() refuses to copy a file to itself
+                os.remove(destination)
+            shutil.copy(source, destination)
+
+
+def write_code_stylesheet(outdir, pygments_style):
+    """Write get_code_css() to outdir for --compact pages."""
+    path = os.path.join(outdir, get_code_stylesheet(pygments_style))
+    with open(path, 'w') as f:
+        f.write(get_code_css(pygments_style))
+
+
+def import_brotli():
+    """Return the brotli module, or None if it's not installed."""
+    try:
+        import brotli
+    except ImportError:
+        # --precompress makes only .gz files without this
+        return None
+    return brotli
+
+
+def compress_file(path, use_brotli):
+    """Write path.gz and possibly path.br next to a file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    # mtime=0 makes the result the same every time
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if use_brotli:
+        with open(path + '.br', 'wb') as f:
+            f.write(import_brotli().compress(data, quality=11))
+
+
+def precompress(outdir, jobs=1):
+    """Write compressed copies of text files in outdir next to them.
+
+    Web servers can send the compressed files as is instead of
+    compressing every response. Files that haven't changed since the
+    previous call are not compressed again, and compressed files whose
+    original files are gone are removed. The compressing is done in
+    jobs threads at a time, 0 means one thread for each CPU core.
+
+    Return a list of the compressed files.
+    """
+    try:
+        with open(os.path.join(outdir, PRECOMPRESS_MANIFEST), 'r') as f:
+            old_hashes = json.load(f)
+    except (OSError, ValueError):
+        old_hashes = {}
+
+    use_brotli = import_brotli() is not None
+    extensions = ['.gz']
+    if use_brotli:
+        extensions.append('.br')
+
+    hashes = {}
+    compressed = []
+    for root, dirs, files in os.walk(outdir):
+        for file in files:
+            path = os.path.join(root, file)
+            if file.endswith(('.gz', '.br')):
+                if not os.path.exists(path[:-3]):
+                    os.remove(path)
+                continue
+            if not file.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+
+            key = os.path.relpath(path, outdir).replace(os.sep, '/')
+            hashes[key] = common.get_file_hash(path)
+            if (old_hashes.get(key) != hashes[key] or not all(
+                    os.path.exists(path + extension)
+                    for extension in extensions)):
+                compressed.append(path)
+
+    # zlib and brotli release the GIL while compressing, so threads
+    # are enough for using many CPU cores
+    import concurrent.futures
+    workers = jobs or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        # list() raises the exception if compressing a file failed
+        list(executor.map(compress_file, compressed,
+                          itertools.repeat(use_brotli)))
+
+    with open(os.path.join(outdir, PRECOMPRESS_MANIFEST), 'w') as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    return compressed
+
+
+# words shorter than this are not indexed
+SEARCH_MIN_LENGTH = 2
+# the index is split to files by this many first characters of words
+SEARCH_PREFIX_LENGTH = 2
+
+
+def get_search_sections(markdownfile):
+    """Split a page to sections for searching.
+
+    Return a list of (url, title, words) tuples where url points to the
+    title of the section in the HTML file and words is a set.
+    """
+    document = common.get_document(markdownfile)
+    htmlfile = fix_filename(markdownfile)
+    page_title = markdownfile
+    for header in document.headers:
+        if header.level == 1:
+            page_title = header.title
+            break
+
+    # (lineno, url, title), text before the first header goes to the page
+    starts = [(1, htmlfile, page_title)]
+    for header in document.headers:
+        if header.level == 1:
+            title = header.title
+        else:
+            title = '%s: %s' % (page_title, header.title)
+        starts.append((header.lineno, htmlfile + '#' + header.link, title))
+
+    # update-ends.py adds the same text after *** to every file
+    lines = document.body.splitlines()
+    result = []
+    for index, (lineno, url, title) in enumerate(starts):
+        if index + 1 < len(starts):
+            end = starts[index+1][0] - 1
+        else:
+            end = len(lines)
+        text = '\n'.join(lines[lineno-1:end])
+        # link targets are not interesting, but link texts are
+        text = re.sub(r'\]\([^)]*\)', ' ', text)
+        words = {word for word in re.findall(r'\w+', text.lower())
+                 if len(word) >= SEARCH_MIN_LENGTH}
+        if words:
+            result.append((url, title, words))
+    return result
+
+
+def _load_search_shard(outdir, prefix):
+    """Return a {word: set of doc ids} dictionary."""
+    path = os.path.join(outdir, SEARCH_DIR, prefix + '.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            encoded = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {word: set(itertools.accumulate(deltas))
+            for word, deltas in encoded.items()}
+
+
+def _save_search_shard(outdir, prefix, shard):
+    path = os.path.join(outdir, SEARCH_DIR, prefix + '.json')
+    if not shard:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    encoded = {}
+    for word, ids in sorted(shard.items()):
+        # small numbers take less space than big numbers
+        ids = sorted(ids)
+        encoded[word] = [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+    with mkdir_and_open(path, 'w') as f:
+        json.dump(encoded, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def update_search_index(outdir):
+    """Update the search index in outdir for the pages that changed.
+
+    The index consists of these files in the search directory:
+
+    docs.json
+        A list of [url, title] lists, one for each section of each page.
+        Indexes of this list are doc ids. Removed sections are null.
+    XY.json
+        A {word: postings} dictionary of all words that start with XY.
+        The postings are sorted doc ids of the sections that contain the
+        word, delta-encoded: [3, 2, 10] means doc ids 3, 5 and 15.
+
+    search.html loads docs.json and the files of the searched words. The
+    doc ids and words of each page are saved to SEARCH_STATE, so only
+    the files of the words that the changed pages contain or contained
+    need to be written when a page changes.
+
+    Return a list of the pages that were indexed.
+    """
+    state_path = os.path.join(outdir, SEARCH_STATE)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        with open(os.path.join(outdir, SEARCH_DIR, 'docs.json'), 'r',
+                  encoding='utf-8') as f:
+            docs = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+        docs = []
+
+    markdownfiles = sorted(common.get_markdown_files())
+    changed = [markdownfile for markdownfile in markdownfiles
+               if markdownfile not in state or
+               state[markdownfile]['hash'] !=
+               common.get_document(markdownfile).hash]
+    removed = sorted(state.keys() - set(markdownfiles))
+
+    # {doc id: set of words} for removing, {prefix: ...} for adding
+    old_words = {}
+    for markdownfile in changed + removed:
+        for doc_id, words in state.pop(markdownfile, {}).get('docs', []):
+            old_words[doc_id] = words
+            docs[doc_id] = None
+
+    new_words = {}
+    free_ids = [doc_id for doc_id, doc in enumerate(docs) if doc is None]
+    free_ids.reverse()
+    for markdownfile in changed:
+        page_docs = []
+        for url, title, words in get_search_sections(markdownfile):
+            if free_ids:
+                doc_id = free_ids.pop()
+                docs[doc_id] = [url, title]
+            else:
+                doc_id = len(docs)
+                docs.append([url, title])
+            new_words[doc_id] = sorted(words)
+            page_docs.append([doc_id, sorted(words)])
+        state[markdownfile] = {
+            'hash': common.get_document(markdownfile).hash,
+            'docs': page_docs,
+        }
+    while docs and docs[-1] is None:
+        docs.pop()
+
+    # {prefix: [(doc id, word), ...]}, so that each shard is updated
+    # with only the words that belong to it
+    old_by_prefix = collections.defaultdict(list)
+    for doc_id, words in old_words.items():
+        for word in words:
+            old_by_prefix[word[:SEARCH_PREFIX_LENGTH]].append((doc_id, word))
+    new_by_prefix = collections.defaultdict(list)
+    for doc_id, words in new_words.items():
+        for word in words:
+            new_by_prefix[word[:SEARCH_PREFIX_LENGTH]].append((doc_id, word))
+
+    for prefix in sorted(old_by_prefix.keys() | new_by_prefix.keys()):
+        shard = _load_search_shard(outdir, prefix)
+        for doc_id, word in old_by_prefix[prefix]:
+            if word in shard:
+                shard[word].discard(doc_id)
+                if not shard[word]:
+                    del shard[word]
+        for doc_id, word in new_by_prefix[prefix]:
+            shard.setdefault(word, set()).add(doc_id)
+        _save_search_shard(outdir, prefix, shard)
+
+    with mkdir_and_open(os.path.join(outdir, SEARCH_DIR, 'docs.json'),
+                        'w') as f:
+        json.dump(docs, f, ensure_ascii=False, separators=(',', ':'))
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(state.items())), f, ensure_ascii=False)
+
+    body = SEARCH_BODY % {'min_length': SEARCH_MIN_LENGTH,
+                          'prefix': SEARCH_PREFIX_LENGTH}
+    with open(os.path.join(outdir, 'search.html'), 'w') as f:
+        f.write(HTML_TEMPLATE.format(
+            title="Search", body=body, stylefile='style.css',
+            extra_head='', search_link='') + '\n')
+    return changed
+
+
+class ReloadNotifier:
+    """Tell the browser tabs showing the tutorial to reload the page."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    def reload(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        """Wait until reload() is called.
+
+        Return False if that doesn't happen in timeout seconds.
+        """
+        with self._condition:
+            generation = self._generation
+            return self._condition.wait_for(
+                lambda: self._generation != generation, timeout)
+
+
+@functools.lru_cache(maxsize=None)
+def get_handler_class(handler, base='BaseHTTPRequestHandler'):
+    """Return a request handler class that inherits from handler and base.
+
+    base is the name of a class in http.server. The handlers don't
+    inherit from it directly because http.server is imported only when
+    something is served, like mistune in get_renderer_class().
+    """
+    import http.server
+    return type(handler.__name__, (handler, getattr(http.server, base)), {})
+
+
+class WatchRequestHandler:
+    """Serve the output directory and reload pages when they change.
+
+    HTML pages get RELOAD_SCRIPT added to them, and the script keeps a
+    connection to /__reload__ open for getting reload messages. Use
+    get_handler_class(WatchRequestHandler, 'SimpleHTTPRequestHandler')
+    to get the actual handler class.
+    """
+
+    def __init__(self, *args, notifier, **kwargs):
+        self.notifier = notifier
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path == '/__reload__':
+            self.send_reload_events()
+            return
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if path.endswith('.html') and os.path.isfile(path):
+            with open(path, 'r') as f:
+                html = f.read()
+            html = html.replace('</body>', RELOAD_SCRIPT + '</body>', 1)
+            content = html.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            super().do_GET()
+
+    def send_reload_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while True:
+                if self.notifier.wait(timeout=15):
+                    self.wfile.write(b'data: reload\n\n')
+                else:
+                    # comments keep the connection alive
+                    self.wfile.write(b': ping\n\n')
+                self.wfile.flush()
+        except OSError:
+            # the tab was closed or reloaded
+            pass
+
+    def log_message(self, format, *args):
+        # the default prints every request, that's too much
+        pass
+
+
+def get_watched_files():
+    """Return a {filename: (mtime, size)} dictionary of source files."""
+    filenames = list(common.get_markdown_files())
+    filenames.extend(source for source, destination in OTHER_FILES)
+    for root, dirs, files in os.walk('images'):
+        for file in files:
+            filenames.append(posixpath.join(root.replace(os.sep, '/'), file))
+
+    result = {}
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            # removed while we were looking at it
+            continue
+        result[filename] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def update_output(outdir, filename, pygments_style, highlight_cache,
+                  manifest, compact=False, search_link=False):
+    """Update the output of a source file that changed or was removed."""
+    if filename.endswith('.md'):
+        fixed_file = fix_filename(filename)
+        common.forget_document(filename)
+        if os.path.isfile(filename):
+            html = render_page(filename, pygments_style, highlight_cache,
+                               compact, search_link)
+            with mkdir_and_open(os.path.join(outdir, fixed_file), 'w') as f:
+                f.write(html)
+            manifest['pages'][filename] = {
+                'source': common.get_document(filename).hash,
+                'output': fixed_file,
+                'output_hash': common.get_hash(html),
+            }
+        else:
+            remove_output(outdir, fixed_file)
+            manifest['pages'].pop(filename, None)
+        return
+
+    other_files = dict(OTHER_FILES)
+    destination = other_files.get(filename, filename)
+    if not os.path.isfile(filename):
+        remove_output(outdir, destination)
+    elif filename in other_files:
+        # copied like in copy_other_files()
+        shutil.copy(filename, os.path.join(outdir, destination))
+    else:
+        # assets may be hard links to the source files
+        link_or_copy(filename, os.path.join(outdir, destination))
+
+
+def watch(outdir, pygments_style, highlight_cache, port, interval=0.1,
+          compact=False, search_link=False):
+    """Update outdir when source files change and serve it on localhost.
+
+    This runs until it's interrupted with Ctrl+C.
+    """
+    import http.server
+    notifier = ReloadNotifier()
+    handler = functools.partial(
+        get_handler_class(WatchRequestHandler, 'SimpleHTTPRequestHandler'),
+        directory=outdir, notifier=notifier)
+    server = http.server.ThreadingHTTPServer(('localhost', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = 'http://localhost:%d/' % server.server_address[1]
+    print("Serving the tutorial at %s" % url)
+    print("Watching for changes, press Ctrl+C to stop.")
+
+    manifest = load_manifest(outdir)
+    files = get_watched_files()
+    try:
+        while True:
+            time.sleep(interval)
+            new_files = get_watched_files()
+            changed = sorted(
+                filename for filename in files.keys() | new_files.keys()
+                if files.get(filename) != new_files.get(filename))
+            files = new_files
+            if not changed:
+                continue
+
+            start = time.perf_counter()
+            for filename in changed:
+                update_output(outdir, filename, pygments_style,
+                              highlight_cache, manifest, compact,
+                              search_link)
+            save_manifest(outdir, manifest)
+            notifier.reload()
+            print("  Updated %s in %.1f ms"
+                  % (', '.join(changed), (time.perf_counter() - start) * 1000))
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class ArchiveWriter:
+    """Write files into a zip or tar archive one by one.
+
+    All files get the same timestamp and permissions, so the archive is
+    the same every time if the files are added in the same order. The
+    archive type is chosen by the file name extension: .zip, .tar,
+    .tar.gz or .tgz.
+    """
+
+    # zip files can't represent earlier times, tar files use 0
+    TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+    def __init__(self, filename):
+        import tarfile
+        import zipfile
+        self.filename = filename
+        self._gzip = None
+        if filename.endswith('.zip'):
+            self._zip = zipfile.ZipFile(filename, 'w')
+            self._tar = None
+        elif filename.endswith(('.tar', '.tar.gz', '.tgz')):
+            self._zip = None
+            if filename.endswith('.tar'):
+                self._tar = tarfile.open(filename, 'w')
+            else:
+                # tarfile's gzip would add the current time and the
+                # file name to the gzip header
+                self._file = open(filename, 'wb')
+                self._gzip = gzip.GzipFile(filename='', mode='wb',
+                                           fileobj=self._file, mtime=0)
+                self._tar = tarfile.open(fileobj=self._gzip, mode='w')
+        else:
+            raise ValueError("unknown archive type: " + filename)
+
+    def add(self, name, data):
+        """Add a file to the archive, data should be a bytes object."""
+        import tarfile
+        import zipfile
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, date_time=self.TIMESTAMP)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 0
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+            if self._gzip is not None:
+                self._gzip.close()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self.close()
+
+
+def build_archive(filename, pygments_style, jobs=1, highlight_cache=None,
+                  optimize_images=False, compact=False):
+    """Write the whole tutorial into an archive instead of a directory.
+
+    Return the number of files in the archive.
+    """
+    markdownfiles = sorted(common.get_markdown_files())
+    count = 0
+    with ArchiveWriter(filename) as archive:
+        results = render_pages(markdownfiles, pygments_style, jobs,
+                               highlight_cache, compact)
+        for number, (markdownfile, html) in enumerate(results, start=1):
+            print_progress(number, len(markdownfiles), markdownfile,
+                           fix_filename(markdownfile), end='\r')
+            with profile_phase('write'):
+                archive.add(fix_filename(markdownfile), html.encode('utf-8'))
+            count += 1
+        print()
+
+        with profile_phase('copy'):
+            files = list(OTHER_FILES)
+            for path in sorted(get_referenced_assets(
+                    common.update_dependency_graph())):
+                if optimize_images and path.endswith('.png'):
+                    files.append((get_optimized_png(path), path))
+                else:
+                    files.append((path, path))
+            for source, destination in files:
+                with open(source, 'rb') as f:
+                    archive.add(destination, f.read())
+                count += 1
+            if compact:
+                archive.add(get_code_stylesheet(pygments_style),
+                            get_code_css(pygments_style).encode('utf-8'))
+                count += 1
+    return count
+
+
+class ArchiveReader:
+    """Read files from an archive made with ArchiveWriter."""
+
+    def __init__(self, filename):
+        import calendar
+        import tarfile
+        import zipfile
+        self._lock = threading.Lock()
+        if zipfile.is_zipfile(filename):
+            self._zip = zipfile.ZipFile(filename, 'r')
+            self._tar = None
+            infos = self._zip.infolist()
+            self.mtime = calendar.timegm(infos[0].date_time)
+        else:
+            self._zip = None
+            self._tar = tarfile.open(filename, 'r')
+            infos = self._tar.getmembers()
+            self.mtime = infos[0].mtime
+        self._infos = {info.filename if self._zip else info.name: info
+                       for info in infos}
+
+    def read(self, name):
+        """Return the content of a file or raise FileNotFoundError."""
+        if name not in self._infos:
+            raise FileNotFoundError(name)
+        # reading the same archive file in many threads needs care
+        with self._lock:
+            if self._zip is not None:
+                return self._zip.read(self._infos[name])
+            return self._tar.extractfile(self._infos[name]).read()
+
+    def has_directory(self, name):
+        return any(other.startswith(name + '/') for other in self._infos)
+
+
+class ArchiveRequestHandler:
+    """Serve the files of an archive like they were extracted.
+
+    Use get_handler_class() to get the actual handler class.
+    """
+
+    def __init__(self, *args, archive, **kwargs):
+        self.archive = archive
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        import email.utils
+        import mimetypes
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        path = posixpath.normpath(url_path.lstrip('/'))
+        if url_path.endswith('/') or path == '.':
+            path = posixpath.normpath(posixpath.join(path, 'index.html'))
+        elif self.archive.has_directory(path):
+            self.send_response(301)
+            self.send_header('Location', url_path + '/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        try:
+            content = self.archive.read(path)
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        content_type = (mimetypes.guess_type(path)[0] or
+                        'application/octet-stream')
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Last-Modified',
+                         email.utils.formatdate(self.archive.mtime,
+                                                usegmt=True))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_source_file(url_path):
+    """Return the source file of an output file, or None if there's none.
+
+    This does the opposite of fix_filename(), e.g. basics/ and
+    basics/index.html become basics/README.md.
+    """
+    path = posixpath.normpath(url_path.lstrip('/'))
+    if path == '.':
+        path = ''
+    if path.startswith('../') or path == '..':
+        return None
+    if path == '' or url_path.endswith('/'):
+        path = posixpath.join(path, 'index.html')
+
+    for source, destination in OTHER_FILES:
+        if path == destination:
+            return source
+    if posixpath.basename(path) == 'index.html':
+        return path[:-len('index.html')] + 'README.md'
+    if path.endswith('.html'):
+        return path[:-len('.html')] + '.md'
+    if path.split('/')[0] in ASSET_DIRS:
+        return path
+    return None
+
+
+class PageCache:
+    """Render pages when they are needed and remember the newest ones.
+
+    Pages are rendered again only if their markdown file changes. If
+    the modification time changes but the content doesn't, the old
+    HTML is still used.
+    """
+
+    def __init__(self, pygments_style, highlight_cache, max_pages):
+        self.pygments_style = pygments_style
+        self.highlight_cache = highlight_cache
+        self.max_pages = max_pages
+        # {markdownfile: (stat, source hash, html bytes, etag)}
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, markdownfile):
+        """Return (html, etag, mtime) or raise FileNotFoundError."""
+        stat = os.stat(markdownfile)
+        with self._lock:
+            cached = self._pages.get(markdownfile)
+            if cached is not None and cached[0] == (stat.st_mtime_ns,
+                                                    stat.st_size):
+                self._pages.move_to_end(markdownfile)
+                return (cached[2], cached[3], stat.st_mtime)
+
+            common.forget_document(markdownfile)
+            source_hash = common.get_document(markdownfile).hash
+            if cached is not None and cached[1] == source_hash:
+                # touched, but not changed
+                html, etag = cached[2], cached[3]
+            else:
+                html = render_page(markdownfile, self.pygments_style,
+                                   self.highlight_cache).encode('utf-8')
+                etag = '"%s"' % common.get_hash(html)[:32]
+
+            self._pages[markdownfile] = ((stat.st_mtime_ns, stat.st_size),
+                                         source_hash, html, etag)
+            self._pages.move_to_end(markdownfile)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+            return (html, etag, stat.st_mtime)
+
+
+class PreviewRequestHandler:
+    """Render the pages of the tutorial when they are requested.
+
+    Responses have ETag and Last-Modified headers, so browsers can ask
+    whether a page has changed and get a short 304 response if not.
+    Use get_handler_class() to get the actual handler class.
+    """
+
+    def __init__(self, *args, page_cache, **kwargs):
+        self.page_cache = page_cache
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        import email.utils
+        import mimetypes
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if (not url_path.endswith('/') and
+                os.path.isdir(url_path.lstrip('/') or '.')):
+            # relative links on the page wouldn't work without the /
+            self.send_response(301)
+            self.send_header('Location', url_path + '/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        source = get_source_file(url_path)
+        try:
+            if source is None:
+                raise FileNotFoundError
+            if source.endswith('.md'):
+                content, etag, mtime = self.page_cache.get(source)
+                content_type = 'text/html; charset=utf-8'
+            else:
+                with open(source, 'rb') as f:
+                    content = f.read()
+                stat = os.stat(source)
+                mtime = stat.st_mtime
+                etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+                content_type = (mimetypes.guess_type(url_path)[0] or
+                                'application/octet-stream')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            self.send_error(404)
+            return
+
+        if self.is_not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         email.utils.formatdate(mtime, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(content)
+
+    def is_not_modified(self, etag, mtime):
+        import email.utils
+        if 'If-None-Match' in self.headers:
+            # If-Modified-Since must be ignored if this is present
+            return etag in self.headers['If-None-Match'].split(', ')
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers['If-Modified-Since'])
+            except (TypeError, ValueError):
+                return False
+            # Last-Modified has no fractions of seconds
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(pygments_style, highlight_cache, port, max_pages=50, archive=None):
+    """Serve the tutorial on localhost without building it first.
+
+    If archive is given, the files are served from an archive made by
+    build_archive() instead of rendering anything. This runs until
+    it's interrupted with Ctrl+C.
+    """
+    import http.server
+    if archive is None:
+        page_cache = PageCache(pygments_style, highlight_cache, max_pages)
+        handler = functools.partial(get_handler_class(PreviewRequestHandler),
+                                    page_cache=page_cache)
+    else:
+        handler = functools.partial(get_handler_class(ArchiveRequestHandler),
+                                    archive=ArchiveReader(archive))
+    server = http.server.ThreadingHTTPServer(('localhost', port), handler)
+    server.daemon_threads = True
+    print("Serving the tutorial at http://localhost:%d/"
+          % server.server_address[1])
+    if archive is None:
+        print("Pages are rendered when they are opened. "
+              "Press Ctrl+C to stop.")
+    else:
+        print("Serving files from %r. Press Ctrl+C to stop." % archive)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+
+
+def is_interactive():
+    """Check if someone can answer questions asked with askyesno()."""
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
 def main():
     desc = ("Create HTML files of the tutorial.\n\n"
             "The files have light text on a dark background by "
             "default, and you can edit html-style.css to change that.")
-    if pygments is not None:
+    pygments_installed = has_pygments()
+    if pygments_installed:
         desc += (
             " Editing the style file doesn't change the colors of the "
             "code examples, but you can use the --pygments-style "
@@ -212,18 +2018,151 @@ def main():
     parser = argparse.ArgumentParser(
         description=wrap_text(desc),
         formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'command', nargs='?', choices=['build', 'serve'], default='build',
+        help=("'build' writes HTML files to OUTDIR, 'serve' renders pages "
+              "on localhost when they are opened without writing "
+              "anything, defaults to %(default)r"))
     parser.add_argument(
         '-o', '--outdir', default='html',
         help="write the HTML files here, defaults to %(default)r")
-    if pygments is not None:
+    if pygments_installed:
+        parser.add_argument(
+            '--pygments-style', metavar='STYLE',
+            help=("the Pygments color style (see above), defaults to a "
+                  "custom style called 'tutorial', or many styles "
+                  "separated by commas for writing the pages with each "
+                  "style to a subdirectory of OUTDIR"))
         parser.add_argument(
-            '--pygments-style', metavar='STYLE', default=TutorialStyle,
-            choices=list(pygments.styles.get_all_styles()),
-            help=("the Pygments color style (see above), "
-                  "defaults to a custom style"))
+            '--highlight-cache', metavar='DIR',
+            default=os.path.join(common.CACHE_DIR, 'highlight'),
+            help=("save highlighted code examples here and reuse them in "
+                  "later builds, defaults to %(default)r"))
+        parser.add_argument(
+            '--highlight-cache-size', metavar='MB', type=float, default=10,
+            help=("remove least recently used code examples from the "
+                  "highlight cache when it gets bigger than this, defaults "
+                  "to %(default)s"))
+        parser.add_argument(
+            '--no-highlight-cache', action='store_true',
+            help="don't use the highlight cache")
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help=("don't remove OUTDIR, only render the pages whose markdown "
+              "files have changed since the previous --incremental build"))
+    parser.add_argument(
+        '--optimize-images', action='store_true',
+        help=("compress PNG images better without changing how they "
+              "look, the results are cached in %s" % PNG_CACHE))
+    parser.add_argument(
+        '--compact', action='store_true',
+        help=("make smaller pages: color the code examples with CSS "
+              "classes from a shared stylesheet instead of a style "
+              "attribute in every piece of code, and remove unnecessary "
+              "whitespace"))
+    parser.add_argument(
+        '--archive', metavar='FILE',
+        help=("write everything into one .zip, .tar, .tar.gz or .tgz "
+              "file instead of OUTDIR, or serve the files from FILE "
+              "with 'serve'"))
+    parser.add_argument(
+        '--search-index', action='store_true',
+        help=("create a search index of the pages and search.html for "
+              "searching them without a server-side program"))
+    parser.add_argument(
+        '--precompress', action='store_true',
+        help=("write .gz files (and .br files if the brotli module is "
+              "installed) next to the HTML, CSS and text files for web "
+              "servers that can send them as is"))
+    parser.add_argument(
+        '--profile', metavar='REPORT',
+        help=("measure the time of each phase, page and code example, "
+              "print the slowest ones and write a JSON report to REPORT"))
+    parser.add_argument(
+        '--profile-memory', action='store_true',
+        help=("also measure the peak memory of each phase and page with "
+              "--profile, this makes everything much slower"))
+    parser.add_argument(
+        '--cprofile', metavar='FILE',
+        help=("save cProfile statistics of rendering the pages to FILE, "
+              "see the pstats module for reading them"))
+    parser.add_argument(
+        '--watch', action='store_true',
+        help=("build like --incremental, then keep running, update the "
+              "HTML files whenever source files change and serve them on "
+              "localhost so that web browsers reload changed pages"))
+    parser.add_argument(
+        '--port', type=int, default=8000,
+        help=("the port that --watch and serve use, "
+              "defaults to %(default)s"))
+    parser.add_argument(
+        '--max-pages', metavar='N', type=int, default=50,
+        help=("keep N rendered pages in memory with serve, "
+              "defaults to %(default)s"))
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=1,
+        help=("render N pages at a time in separate processes, 0 means "
+              "one process for each CPU core, defaults to %(default)s"))
     args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+    if args.profile_memory and args.profile is None:
+        parser.error("--profile-memory can only be used with --profile")
+    if args.watch:
+        args.incremental = True
+    if args.compact and args.command == 'serve':
+        parser.error("--compact can't be used with serve")
+    if args.archive is not None and args.command == 'build':
+        if not args.archive.endswith(('.zip', '.tar', '.tar.gz', '.tgz')):
+            parser.error("--archive must end with .zip, .tar, .tar.gz or "
+                         ".tgz")
+        for option in ['incremental', 'search_index', 'precompress']:
+            if getattr(args, option):
+                parser.error("--archive can't be used with --%s"
+                             % option.replace('_', '-'))
+
+    if args.command == 'build' or args.archive is None:
+        find_mistune()
+
+    if pygments_installed:
+        # dict.fromkeys() removes duplicates and keeps the order
+        style_names = list(dict.fromkeys(
+            (args.pygments_style or 'tutorial').split(',')))
+        args.pygments_styles = []
+        for name in style_names:
+            if name == 'tutorial':
+                args.pygments_styles.append(get_tutorial_style())
+                continue
+            # checking only this style is faster than listing all styles
+            import_pygments()
+            try:
+                pygments.styles.get_style_by_name(name)
+            except pygments.util.ClassNotFound:
+                parser.error("there's no Pygments style named %r, choose "
+                             "from tutorial, %s" % (name, ', '.join(
+                                 sorted(pygments.styles.get_all_styles()))))
+            args.pygments_styles.append(name)
+        args.pygments_style = args.pygments_styles[0]
+    else:
+        style_names = ['plain']
+        args.pygments_styles = [None]
 
-    if pygments is None:
+    if len(style_names) > 1:
+        if args.command == 'serve':
+            parser.error("serve can't be used with many Pygments styles")
+        for option in ['incremental', 'watch', 'archive']:
+            if getattr(args, option):
+                parser.error("--%s can't be used with many Pygments styles"
+                             % option)
+        outdirs = [os.path.join(args.outdir, name) for name in style_names]
+    else:
+        outdirs = [args.outdir]
+
+    if not pygments_installed and args.command == 'serve':
+        print("Pygments isn't installed, so the code examples will not be "
+              "colored.")
+        args.pygments_style = None
+    elif not pygments_installed:
         print("Pygments isn't installed. You can install it like this:")
         print()
         print("    %s -m pip install pygments" % python)
@@ -235,7 +2174,39 @@ def main():
             return
         args.pygments_style = None
 
-    if os.path.exists(args.outdir):
+    if not pygments_installed or args.no_highlight_cache:
+        highlight_cache = None
+    else:
+        highlight_cache = HighlightCache(
+            args.highlight_cache, int(args.highlight_cache_size * 1024 * 1024))
+
+    if args.command == 'serve':
+        serve(args.pygments_style, highlight_cache, args.port,
+              args.max_pages, args.archive)
+        return
+
+    if args.archive is not None:
+        print("Writing the tutorial to %s..." % args.archive)
+        count = build_archive(args.archive, args.pygments_style, args.jobs,
+                              highlight_cache, args.optimize_images,
+                              args.compact)
+        print("Ready! Wrote %d files to %r." % (count, args.archive))
+        print("You can serve it with '%s make-html.py serve --archive %s'."
+              % (python, args.archive))
+        return
+
+    if os.path.exists(args.outdir) and not (
+            args.incremental and load_manifest(args.outdir) is not None):
+        if not is_interactive():
+            # probably running in CI, nobody is there to answer
+            if args.incremental:
+                print("%s exists, but it wasn't created with --incremental."
+                      % args.outdir, file=sys.stderr)
+            else:
+                print("%s exists." % args.outdir, file=sys.stderr)
+            print("Remove it or choose another directory with --outdir.",
+                  file=sys.stderr)
+            sys.exit(1)
         if not common.askyesno("%s exists. Do you want to remove it?"
                                % args.outdir):
             print("Interrupt.")
@@ -245,40 +2216,103 @@ def main():
         else:
             os.remove(args.outdir)
 
-    print("Generating HTML files...")
-    for markdownfile in common.get_markdown_files():
-        fixed_file = fix_filename(markdownfile)
-        htmlfile = posixpath.join(args.outdir, fixed_file)
-        print('  %-30.30s  -->  %-30.30s' % (markdownfile, htmlfile), end='\r')
+    if args.profile is not None or args.cprofile is not None:
+        global profiler
+        profiler = Profiler(trace_memory=args.profile_memory)
+        if args.jobs != 1:
+            print("--profile and --cprofile render one page at a time, so "
+                  "--jobs is ignored.")
+            args.jobs = 1
+    if args.cprofile is None:
+        cprofiler = None
+    else:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
 
-        with open(markdownfile, 'r') as f:
-            markdown = f.read()
-        renderer = TutorialRenderer(args.pygments_style)
-        body = mistune.markdown(markdown, renderer=renderer)
-        stylefile = posixpath.relpath(
-            'style.css', posixpath.dirname(fixed_file))
-
-        html = HTML_TEMPLATE.format(
-            title=renderer.title,
-            body=body,
-            stylefile=stylefile,
-        )
-        with mkdir_and_open(htmlfile, 'w') as f:
-            print(html, file=f)
+    print("Generating HTML files...")
+    if args.incremental:
+        build_incremental(args.outdir, args.pygments_style, args.jobs,
+                          highlight_cache, args.compact, args.search_index)
+    else:
+        markdownfiles = sorted(common.get_markdown_files())
+        results = render_pages_styles(
+            markdownfiles, args.pygments_styles, args.jobs, highlight_cache,
+            args.compact, args.search_index)
+        for number, (markdownfile, htmls) in enumerate(results, start=1):
+            for outdir, html in zip(outdirs, htmls):
+                htmlfile = posixpath.join(outdir, fix_filename(markdownfile))
+                print_progress(number, len(markdownfiles), markdownfile,
+                               htmlfile, end='\r')
+                with profile_phase('write'), \
+                        mkdir_and_open(htmlfile, 'w') as f:
+                    f.write(html)
     print()
+    if highlight_cache is not None:
+        removed = highlight_cache.cleanup()
+        print("Highlight cache: %d hits, %d misses, %d old files removed"
+              % (highlight_cache.hits, highlight_cache.misses, removed))
+
+    if cprofiler is not None:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.cprofile)
+        print("Wrote cProfile output of the rendering to %r." % args.cprofile)
+        print()
+
+    if args.search_index:
+        print("Updating the search index...")
+        with profile_phase('search'):
+            indexed = []
+            for outdir in outdirs:
+                indexed.extend(update_search_index(outdir))
+        print("  %d pages needed indexing, open search.html to search"
+              % len(indexed))
+        print()
 
     print("Copying other files...")
-    shutil.copytree('images', os.path.join(args.outdir, 'images'))
-    shutil.copy('LICENSE', os.path.join(args.outdir, 'LICENSE.txt'))
-    shutil.copy('html-style.css', os.path.join(args.outdir, 'style.css'))
+    for outdir, pygments_style in zip(outdirs, args.pygments_styles):
+        copy_other_files(outdir, args.optimize_images)
+        if args.compact:
+            write_code_stylesheet(outdir, pygments_style)
+
+    if args.precompress:
+        if import_brotli() is None:
+            print("Compressing files with gzip...")
+        else:
+            print("Compressing files with gzip and brotli...")
+        with profile_phase('compress'):
+            compressed = []
+            for outdir in outdirs:
+                compressed.extend(precompress(outdir, args.jobs))
+        print("  %d files needed compressing" % len(compressed))
+
+    if profiler is not None:
+        print()
+        profiler.print_report()
+        if args.profile is not None:
+            with open(args.profile, 'w') as f:
+                json.dump(profiler.get_report(), f, indent=2)
+            print("Wrote the profiling report to %r." % args.profile)
+
+    if args.watch:
+        print()
+        watch(args.outdir, args.pygments_style, highlight_cache, args.port,
+              compact=args.compact, search_link=args.search_index)
+        return
 
     print("\n*********************\n")
-    print("Ready! The files are in %r." % args.outdir)
+    if len(outdirs) > 1:
+        print("Ready! The files are in %s." % ', '.join(map(repr, outdirs)))
+    else:
+        print("Ready! The files are in %r." % args.outdir)
     print("You can go there and double-click index.html to read the tutorial.")
+    if args.incremental or not is_interactive():
+        return
     print()
     if common.askyesno("Do you want to view the tutorial now?", default=False):
         print("Opening the tutorial...")
-        webbrowser.open(os.path.join(args.outdir, 'index.html'))
+        import webbrowser
+        webbrowser.open(os.path.join(outdirs[0], 'index.html'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+"""Tests for linkcheck.py --external against a local HTTP server."""
+
+import collections
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import linkcheck     # noqa
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def respond(self):
+        counts = self.server.counts
+        with self.server.lock:
+            counts[self.command, self.path] += 1
+            heads = counts['HEAD', self.path]
+
+        parts = self.path.strip('/').split('/')
+        if parts[0] == 'ok':
+            status = 200
+        elif parts[0] == 'no-head':
+            status = 405 if self.command == 'HEAD' else 200
+        elif parts[0] == 'flaky':
+            # the status code in the path for the first 2 attempts
+            status = int(parts[1]) if heads <= 2 else 200
+        elif parts[0] == 'slow':
+            time.sleep(0.2)
+            status = 200
+        else:
+            status = 404
+
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_HEAD = do_GET = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(linkcheck.aiohttp is None, "aiohttp is not installed")
+class CheckExternalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(
+            ('localhost', 0), Handler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def setUp(self):
+        self.server.counts = collections.Counter()
+        self.tempdir = tempfile.TemporaryDirectory()
+        cache = os.path.join(self.tempdir.name, 'external-links.json')
+        patcher = mock.patch.object(linkcheck, 'EXTERNAL_CACHE', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tempdir.cleanup)
+
+    def url(self, path):
+        return 'http://localhost:%d%s' % (self.server.server_port, path)
+
+    def check(self, paths, **kwargs):
+        urls = [self.url(path) for path in paths]
+        results = linkcheck.check_external(urls, **kwargs)
+        return [results[url] for url in urls]
+
+    def test_head_to_get_fallback(self):
+        self.assertEqual(self.check(['/ok', '/no-head']), ["ok", "ok"])
+        self.assertEqual(self.server.counts['GET', '/ok'], 0)
+        self.assertEqual(self.server.counts['HEAD', '/no-head'], 1)
+        self.assertEqual(self.server.counts['GET', '/no-head'], 1)
+
+    def test_retries(self):
+        self.assertEqual(
+            self.check(['/flaky/503', '/flaky/429'], retries=2),
+            ["ok", "ok"])
+        self.assertEqual(self.server.counts['HEAD', '/flaky/503'], 3)
+        self.assertEqual(self.server.counts['HEAD', '/flaky/429'], 3)
+
+        self.server.counts.clear()
+        self.assertEqual(self.check(['/flaky/500'], retries=1),
+                         ["HTTP status 500"])
+        self.assertEqual(self.server.counts['HEAD', '/flaky/500'], 2)
+
+    def test_no_retrying_404(self):
+        self.assertEqual(self.check(['/missing'], retries=2),
+                         ["HTTP status 404"])
+        self.assertEqual(self.server.counts['HEAD', '/missing'], 1)
+
+    def test_cache_ttl(self):
+        self.check(['/ok', '/missing'], retries=0)
+        self.check(['/ok', '/missing'], retries=0)
+        # working URLs are cached, broken URLs are not
+        self.assertEqual(self.server.counts['HEAD', '/ok'], 1)
+        self.assertEqual(self.server.counts['HEAD', '/missing'], 2)
+
+        self.assertEqual(self.check(['/ok'], cache_ttl=0), ["ok"])
+        self.assertEqual(self.server.counts['HEAD', '/ok'], 2)
+
+    def test_waiting_for_host_is_not_timeout(self):
+        # 12 URLs, 2 at a time and 0.2 seconds each takes 1.2 seconds,
+        # but each URL takes only 0.2 seconds after it gets its turn
+        paths = ['/slow/%d' % number for number in range(12)]
+        results = self.check(paths, max_per_host=2, timeout=1, retries=0)
+        self.assertEqual(results, ["ok"] * len(paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,8 +28,13 @@
 
 """Update ends of markdown files."""
 
+import argparse
+import concurrent.futures
+import os
 import posixpath
 import re
+import sys
+import tempfile
 
 import common
 
@@ -50,70 +55,56 @@ You may use this tutorial freely at your own risk. See
 CHAPTER_LINK_REGEX = r'^\d+\. \[.*\]\((.*\.md)\)$'
 
 
-def get_filenames():
+def get_filenames(contents=None):
     """Get chapter files and other files from README.
 
     Return a two-tuple of chapter file names and other file names as
-    iterables of strings.
+    iterables of strings. If contents is a get_contents() result from
+    update-readmes.py, the chapters are taken from it instead of
+    reading README.md again.
     """
     chapters = []
-    with open('README.md', 'r') as f:
-        # move to where the content list starts
-        while f.readline().strip() != "## List of contents":
-            pass
-
-        # now let's read the content list
-        for line in f:
-            line = line.strip()
-            if line.startswith('## '):
-                # end of content list
-                break
-            if line:
-                # not empty line
-                match = re.search(CHAPTER_LINK_REGEX, line)
-                if match is not None:
-                    # it's a link to a chapter
-                    chapters.append(match.group(1))
+    if contents is None:
+        lines = iter(common.get_document('README.md').lines)
+    else:
+        lines = iter(['## List of contents\n'] +
+                     ''.join(contents.values()).splitlines())
+
+    # move to where the content list starts
+    while next(lines).strip() != "## List of contents":
+        pass
+
+    # now let's read the content list
+    for line in lines:
+        line = line.strip()
+        if line.startswith('## '):
+            # end of content list
+            break
+        if line:
+            # not empty line
+            match = re.search(CHAPTER_LINK_REGEX, line)
+            if match is not None:
+                # it's a link to a chapter
+                chapters.append(match.group(1))
 
     others = set(common.get_markdown_files()) - set(chapters)
     return chapters, others
 
 
-def update_end(filename, end):
-    """Add *** and end to a file if it doesn't have them already.
+def get_ends(contents=None):
+    """Return a list of (filename, end) pairs for all markdown files.
 
-    filename should be relative to the toplevel using / as a path
-    separator.
+    The chapter files come first in the order of the content list, and
+    the other files after them. See get_filenames() for contents.
     """
-    end = '\n***\n\n' + end
-    with open(filename, 'r') as f:
-        content = f.read()
-    if content.endswith(end):
-        # No need to do anything.
-        print("  Has correct end:", filename)
-        return
-
-    if '\n***\n' in content:
-        # We need to remove the old ending first.
-        print("  Removing old end:", filename)
-        where = content.index('\n***\n')
-        with open(filename, 'w') as f:
-            f.write(content[:where])
-
-    print("  Adding end:", filename)
-    with open(filename, 'a') as f:
-        f.write(end)
-
-
-def main():
-    chapter_files, other_files = get_filenames()
+    chapter_files, other_files = get_filenames(contents)
 
     # make previous of first file and next of last file to just bring
     # back to README
     prevs = ['README.md'] + chapter_files[:-1]
     nexts = chapter_files[1:] + ['README.md']
 
-    print("Chapter files:")
+    result = []
     for prevpath, thispath, nextpath in zip(prevs, chapter_files, nexts):
         # all paths should be like 'section/file.md'
         where = posixpath.dirname(thispath)
@@ -122,17 +113,99 @@ def main():
         extralinks = "[Previous](%s) | [Next](%s) |\n" % (prev, next_)
         end = END_TEMPLATE.format(
             toplevel='..', extralinks=extralinks, readmeheader=where)
-        update_end(thispath, end)
+        result.append((thispath, end))
 
-    print()
-
-    print("Other files:")
-    for filename in other_files:
+    for filename in sorted(other_files):
         where = posixpath.dirname(filename)
         end = END_TEMPLATE.format(
             toplevel=posixpath.relpath('.', where),
             extralinks="", readmeheader='list-of-contents')
-        update_end(filename, end)
+        result.append((filename, end))
+
+    return result
+
+
+def has_end(filename, end):
+    """Check if a file ends with *** and end.
+
+    Only the last few hundred bytes of the file are read, so this is
+    fast even if the file is big. Like when reading the file in text
+    mode, \r\n is treated the same as \n.
+    """
+    end = ('\n***\n\n' + end).encode('utf-8')
+    # the end is longer if every \n is \r\n in the file
+    tail_size = len(end) + end.count(b'\n')
+    with open(filename, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - tail_size))
+        tail = f.read().replace(b'\r\n', b'\n')
+    return tail.endswith(end)
+
+
+def update_end(filename, end):
+    """Add *** and end to a file if it doesn't have them already.
+
+    filename should be relative to the toplevel using / as a path
+    separator. The old end is replaced if there is one. Return True if
+    the file was changed and False if it already had the correct end.
+    """
+    if has_end(filename, end):
+        return False
+
+    # write everything to a temporary file and then rename it, so the
+    # file is never left half-written
+    content = common.get_document(filename).body + '\n***\n\n' + end
+    directory = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False,
+                                     encoding='utf-8') as f:
+        f.write(content)
+    try:
+        os.chmod(f.name, os.stat(filename).st_mode)
+        os.replace(f.name, filename)
+    except OSError:
+        os.remove(f.name)
+        raise
+    common.forget_document(filename)
+    return True
+
+
+def update_ends(ends):
+    """Call update_end() for each (filename, end) pair of get_ends().
+
+    Return a list of the files that changed.
+    """
+    # the files don't depend on each other, so they can be updated at
+    # the same time
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        results = executor.map(lambda pair: update_end(*pair), ends)
+        return [filename for (filename, end), changed in zip(ends, results)
+                if changed]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add or update the ends of the markdown files.")
+    parser.add_argument(
+        '--check', action='store_true',
+        help=("don't change anything, just list the files with wrong "
+              "ends and exit with a nonzero status if there are any"))
+    args = parser.parse_args()
+
+    ends = get_ends()
+    if args.check:
+        stale = [filename for filename, end in ends
+                 if not has_end(filename, end)]
+        for filename in stale:
+            print("Wrong end:", filename)
+        if stale:
+            print("Run update-ends.py to fix %d file(s)." % len(stale))
+            sys.exit(1)
+        return
+
+    changed = update_ends(ends)
+    for filename in changed:
+        print("Updated end:", filename)
+    print("%d/%d files had to be updated." % (len(changed), len(ends)))
 
 
 if __name__ == '__main__':
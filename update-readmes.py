@@ -46,25 +46,27 @@ def get_contents():
 
     Return a {chaptername: content} dictionary.
     """
-    result = {} 
+    result = {}
     current_section = None
+    document = common.get_document('README.md')
+    header_links = {header.lineno: header.link for header in document.headers}
+    lines = enumerate(document.lines, start=1)
 
-    with open('README.md', 'r') as f:
-        # move to where the content list starts
-        while f.readline().strip() != "## List of contents":
-            pass
-
-        for line in f:
-            if line.startswith('### '):
-                # new section
-                current_section = common.header_link(line.lstrip('#').strip())
-                result[current_section] = line[2:]  # one # instead of 3
-            elif line.startswith('## '):
-                # end of content lists
-                break
-            elif current_section is not None:
-                # we are currently in a section
-                result[current_section] += line
+    # move to where the content list starts
+    while next(lines)[1].strip() != "## List of contents":
+        pass
+
+    for lineno, line in lines:
+        if line.startswith('### '):
+            # new section
+            current_section = header_links[lineno]
+            result[current_section] = line[2:]  # one # instead of 3
+        elif line.startswith('## '):
+            # end of content lists
+            break
+        elif current_section is not None:
+            # we are currently in a section
+            result[current_section] += line
 
     return result
 
@@ -75,9 +77,8 @@ def update_file(filename, content):
     Return True if the file changed and False if it didn't.
     """
     try:
-        with open(filename, 'r') as f:
-            # ignore the end
-            old_content = f.read().split('\n***\n')[0].rstrip()
+        # ignore the end
+        old_content = common.get_document(filename).body.rstrip()
         if old_content == content:
             print("Has correct content:", filename)
             return False
@@ -86,14 +87,23 @@ def update_file(filename, content):
         pass
 
     print("Writing new content:", filename)
-    with open(filename, 'w') as f:
+    with open(filename, 'w', encoding='utf-8') as f:
         print(content, file=f)
+    common.forget_document(filename)
     return True
 
 
-def main():
-    something_changed = False
-    for directory, content in sorted(get_contents().items()):
+def update_readmes(contents=None):
+    """Update the README.md files of all sections.
+
+    contents should be a get_contents() result or None for calling
+    get_contents(). Return a list of the files that changed.
+    """
+    if contents is None:
+        contents = get_contents()
+
+    changed = []
+    for directory, content in sorted(contents.items()):
         if not os.path.exists(directory):
             # something else under the list of contents than a chapter
             # list, doesn't have a separate subdirectory
@@ -104,10 +114,13 @@ def main():
         # current directory, so we fix that
         content = BEGINNING + content.replace(directory + '/', '').rstrip()
         path = os.path.join(directory, 'README.md')
-        this_changed = update_file(path, content)
-        something_changed = something_changed or this_changed
+        if update_file(path, content):
+            changed.append(path)
+    return changed
 
-    if something_changed:
+
+def main():
+    if update_readmes():
         print()
         print("Run update-ends.py now so the files will have correct ends.")
 